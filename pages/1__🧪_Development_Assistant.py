@@ -1,28 +1,13 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import time
-import base64
 from datetime import timedelta
 
-st.set_page_config(
-        page_title="RollShift AI",
-        page_icon="media/brand/RS_Fav.png",
-        layout="centered",
-        
-    )
+from rollshift.assets import asset_base64
+from rollshift.development import load_catalogue
+from rollshift.ui import setup_page
 
-# Display the logo in the sidebar with a small size
-st.logo("media/brand/RS_logo.png", size="large")  # Replace 'logo.png' with your image path or URL
-
-st.markdown(
-    """
-    <style>
-        section[data-testid="stSidebar"] {
-            width: 200px !important; # Set the width to your desired value
-        }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+setup_page()
 
 
 def show_spotify_embed():
@@ -41,118 +26,144 @@ def show_spotify_embed():
                 unsafe_allow_html=True
             )
 
-# Function to autoplay audio
+# Function to autoplay audio (the file is encoded once per process, see rollshift.assets)
 def autoplay_audio(file_path: str):
-    with open(file_path, "rb") as f:
-        data = f.read()
-        b64 = base64.b64encode(data).decode()
-        md = f"""
-            <audio autoplay="true">  
-                <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-            </audio>
-            """
-        st.markdown(md, unsafe_allow_html=True)
-
-# Function to calculate adjusted development time
-def adjust_time(base_time, push_pull):
-    adjustments = {
-        -2: 0.65,  # Pull -2 stops (reduce by 35%)
-        -1: 0.80,  # Pull -1 stop (reduce by 20%)
-         0: 1.00,  # Normal
-         1: 1.30,  # Push +1 stop (increase by 30%)
-         2: 1.50   # Push +2 stops (increase by 50%)
-    }
-    return int(base_time * adjustments.get(push_pull, 1))
+    b64 = asset_base64(file_path)
+    md = f"""
+        <audio autoplay="true">  
+            <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
+        </audio>
+        """
+    st.markdown(md, unsafe_allow_html=True)
+
+TIMER_POLL = 2  # Seconds between server-side checks for agitation and the end of a step
+
+
+# The running step lives in session state as a start timestamp, and in the URL so a
+# reload or reconnect picks the timer back up where it was
+def save_progress(step_index, started=None):
+    st.session_state.step_index = step_index
+    st.session_state.step_started = started
+    st.query_params.clear()
+    if step_index is not None:
+        st.query_params.update(step=step_index, process=process.key, temperature=temperature, push=push_pull)
+    if started is not None:
+        st.query_params["started"] = f"{started:.3f}"
+
+
+# Function to show a countdown that ticks in the browser, so the server isn't involved every second
+def show_countdown(end_time):
+    components.html(
+        f"""
+        <h3 id="countdown" style="text-align: center; font-family: sans-serif; margin: 0;"></h3>
+        <script>
+            const end = {end_time * 1000:.0f};
+            const pad = (value) => String(value).padStart(2, "0");
+            function tick() {{
+                const remaining = Math.max(0, Math.round((end - Date.now()) / 1000));
+                const time = `${{Math.floor(remaining / 3600)}}:${{pad(Math.floor(remaining / 60) % 60)}}:${{pad(remaining % 60)}}`;
+                document.getElementById("countdown").textContent = `⏳ Time Remaining: ${{time}}`;
+            }}
+            tick();
+            setInterval(tick, 250);
+        </script>
+        """,
+        height=50,
+    )
+
+
+# Function to check the running step every TIMER_POLL seconds: shows the agitation alert
+# while an agitation is due and moves on to the next step once the time is up
+@st.fragment(run_every=TIMER_POLL)
+def watch_timer(step_name, duration, agitation_interval=60, agitation_duration=10):
+    elapsed = time.time() - st.session_state.step_started
+    if elapsed >= duration:
+        st.session_state.completed_step = step_name
+        save_progress(st.session_state.step_index + 1)
+        st.rerun()
+    if agitation_interval > 0 and elapsed >= agitation_interval and elapsed % agitation_interval < agitation_duration:
+        st.warning(f"⚠️ Agitate Now! ({int(elapsed // agitation_interval)} agitations done)")
+        autoplay_audio("media/sound_effects/agitation.mp3")
+
 
 # Function to run a timer with agitation alerts
 def run_timer(step_name, duration, agitation_interval=60, agitation_duration=10):
     st.markdown(f"<h2 style='text-align: center;'>{step_name} - {timedelta(seconds=duration)}</h2>", unsafe_allow_html=True)
-    
-    start_time = time.time()
-    end_time = start_time + duration
-    
-    time_display = st.empty()
-    agitation_alert = st.empty()
-    
-    last_displayed_time = None
-    
-    while time.time() < end_time:
-        elapsed = int(time.time() - start_time)
-        remaining = int(end_time - time.time())
-        
-        if remaining != last_displayed_time:
-            time_display.markdown(f"<h3 style='text-align: center;'>⏳ Time Remaining: {timedelta(seconds=remaining)}</h3>", unsafe_allow_html=True)
-            last_displayed_time = remaining
-        
-        if agitation_interval > 0 and elapsed % agitation_interval == 0 and elapsed > 0:
-            agitation_alert.warning(f"⚠️ Agitate Now! ({elapsed // agitation_interval} agitations done)")
-            autoplay_audio("media/sound_effects/agitation.mp3")
-            
-            agitation_end = time.time() + agitation_duration
-            while time.time() < agitation_end:
-                time_display.markdown(f"<h3 style='text-align: center;'>⏳ Time Remaining: {timedelta(seconds=int(end_time - time.time()))}</h3>", unsafe_allow_html=True)
-                time.sleep(1)
-            
-            agitation_alert.empty()
-        
-        time.sleep(1)
-    
-    st.success(f"✅ {step_name} Complete!")
-    st.session_state.step_index += 1
-    st.rerun()
+    show_countdown(st.session_state.step_started + duration)
+    watch_timer(step_name, duration, agitation_interval, agitation_duration)
 
 # Streamlit UI Setup
 st.title("Film Development Assistant 🧪")
 
 
 # Select Chemistry Process
-st.selectbox("Select your chemical process", ["CineStill C-41 Two Bath Process"])
-
-# Temperature Input
-temperature = st.number_input("Enter your chemical temperature (°C)", 30.0, 40.0, 39.0, 0.1)
+# (processes, their time charts and push/pull factors live in rollshift/processes.json;
+# a running development restores its settings from the URL)
+catalogue = load_catalogue()
+process_keys = list(catalogue)
+saved_process = st.query_params.get("process")
+process = catalogue[st.selectbox(
+    "Select your chemical process", process_keys,
+    index=process_keys.index(saved_process) if saved_process in catalogue else 0,
+    format_func=lambda key: catalogue[key].name,
+)]
+
+# Temperature Input: published times only exist for the charted temperatures. A saved
+# temperature is only restored for the process it was saved with.
+low, high = process.chart_range
+saved_temperature = process.nominal_temperature
+if saved_process == process.key and "temperature" in st.query_params:
+    saved_temperature = min(max(float(st.query_params["temperature"]), low), high)
+temperature = st.number_input(
+    "Enter your chemical temperature (°C)", low, high, saved_temperature, 0.1,
+    key=f"temperature_{process.key}", disabled=low == high,
+)
+if low == high:
+    st.caption(f"Times for this process are only published for {low:g} °C.")
 
 # Push/Pull Input
-push_pull = st.selectbox("Select Push/Pull Processing", [-2, -1, 0, 1, 2], format_func=lambda x: f"{x:+} Stops")
+push_options = sorted(process.push_pull)
+saved_push = int(st.query_params.get("push", 0))
+push_pull = st.selectbox(
+    "Select Push/Pull Processing", push_options,
+    index=push_options.index(saved_push) if saved_push in push_options else push_options.index(0),
+    format_func=lambda x: f"{x:+} Stops",
+)
 st.write('Set to zero for standard process')
+st.caption(f"Source: {process.source}")
 
 st.markdown("---")
 show_spotify_embed()
 st.markdown("---")
 
 
-# Film Development Steps
-steps = [
-    ("Pre-Soak", 60),
-    ("Color Developer", adjust_time(210, push_pull), 30, 10),
-    ("Blix (Bleach + Fix)", 480, 30, 10),
-    ("Final Rinse", 180, 0, 0)
-]
+# Film Development Steps: (name, seconds, agitation interval, agitation duration)
+steps = process.schedule(temperature, push_pull)
 
-if "step_index" not in st.session_state or st.session_state.step_index is None:
-    st.session_state.step_index = None
+if "step_index" not in st.session_state:
+    st.session_state.step_index = int(st.query_params["step"]) if "step" in st.query_params else None
+    st.session_state.step_started = float(st.query_params["started"]) if "started" in st.query_params else None
+
+if st.session_state.get("completed_step"):
+    st.success(f"✅ {st.session_state.completed_step} Complete!")
+    st.session_state.completed_step = None
 
 if st.session_state.step_index is None:
     if st.button("▶️ Start Development Process", use_container_width=True):
-        st.session_state.step_index = 0
+        save_progress(0)
         st.rerun()
 elif st.session_state.step_index < len(steps):
     step = steps[st.session_state.step_index]
     st.info(f"🔹 Step {st.session_state.step_index + 1}: {step[0]}")
-    
-    if "step_running" not in st.session_state:
-        st.session_state.step_running = False
-    
-    if not st.session_state.step_running:
+
+    if st.session_state.step_started is None:
         if st.button("▶️ Start Step", use_container_width=True):
-            st.session_state.step_running = True
-            agitation_values = (60, 10) if len(step) < 4 else step[2:]
-            run_timer(step[0], step[1], *agitation_values)
-            v_l = True
-    
-    if st.session_state.step_running:
+            save_progress(st.session_state.step_index, time.time())
+            st.rerun()
+    else:
+        run_timer(*step)
         if st.button("⏭️ Skip Step", use_container_width=True):
-            st.session_state.step_index += 1
-            st.session_state.step_running = False
+            save_progress(st.session_state.step_index + 1)
             st.rerun()
 else:
     st.success("🎉 Film Development Complete! Dry your film and enjoy your negatives.")
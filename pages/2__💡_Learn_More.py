@@ -1,32 +1,11 @@
 import streamlit as st
-import numpy as np
-import cv2
-from PIL import Image
 from streamlit_image_comparison import image_comparison
 
+from rollshift.assets import load_sample
+from rollshift.ui import setup_page
 
-st.set_page_config(
-        page_title="RollShift AI",
-        page_icon="media/brand/RS_Fav.png",
-        layout="centered",
- 
-)
-
-
-st.markdown(
-    """
-    <style>
-        section[data-testid="stSidebar"] {
-            width: 200px !important; # Set the width to your desired value
-        }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
-
-# Display the logo in the sidebar with a small size
-st.logo("media/brand/RS_logo.png", size="large")  # Replace 'logo.png' with your image path or URL
 
+setup_page()
 
 
 st.title("🎞️ RollShift AI: Explained")
@@ -36,11 +15,9 @@ st.markdown("---")
 
 st.subheader("Film Processing - Before & After 📷")
 
-negative_path ="/workspaces/RollShift/media/samples/phoenix-200_negative_sample_1.jpg"
-positive_path = "/workspaces/RollShift/media/samples/phoenix-200_positive_sample_1.jpg"
-
-negative_image = Image.open(negative_path)
-positive_image = Image.open(positive_path)
+# Loaded and downscaled once per process, from paths relative to the repository
+negative_image = load_sample("media/samples/phoenix-200_negative_sample_1.jpg")
+positive_image = load_sample("media/samples/phoenix-200_positive_sample_1.jpg")
 
 # Before-After Image Comparison
 st.write("🔄 Drag to compare:")
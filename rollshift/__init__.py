@@ -0,0 +1,14 @@
+"""RollShift film negative conversion engine.
+
+`rollshift.image` holds the image processing functions, `rollshift.tone` the
+memoized tone-curve lookup tables, `rollshift.stats` the sampled global image
+statistics, `rollshift.pipeline` the staged conversion pipeline,
+`rollshift.filmstrip` frame detection for film strip scans, `rollshift.lut3d` 3D
+lookup tables, `rollshift.profiles` the film-stock profiles built on them,
+`rollshift.proofs` roll proofs converted as one stack of frames,
+`rollshift.metrics` per-stage measurements and profiling, `rollshift.development`
+the development process catalogue, `rollshift.assets` the static files used by
+the pages, `rollshift.ui` their shared page setup, `rollshift.converter` the
+converter page's helpers, `rollshift.engine` the lazy loading and warm-up of the
+image modules and `rollshift.batch` the headless batch converter.
+"""
@@ -0,0 +1,57 @@
+"""Static assets (fonts, sounds, sample images, film profiles) loaded once per process.
+
+Paths are relative to the repository root, whatever the working directory of the
+server. Files are read and encoded on first use and then served from memory, so
+page reruns don't touch the disk; returned arrays are read-only because they are
+shared by every session.
+
+The module is light (no OpenCV or NumPy) so that every page can import it before
+the image engine is loaded (see rollshift.engine); only `load_sample` needs the
+engine, and imports it on its first call.
+"""
+import base64
+import os
+from functools import lru_cache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES_DIR = os.path.join(REPO_DIR, "rollshift", "profiles")  # Film-stock profiles, see rollshift.profiles
+
+
+# Absolute path of a file in the repository, e.g. asset_path("media/fonts/Bristol.otf")
+def asset_path(path):
+    return os.path.join(REPO_DIR, path)
+
+
+@lru_cache(maxsize=None)
+def read_asset(path):
+    with open(asset_path(path), "rb") as asset_file:
+        return asset_file.read()
+
+
+@lru_cache(maxsize=None)
+def asset_base64(path):
+    return base64.b64encode(read_asset(path)).decode("utf-8")
+
+
+# RGB copy of a sample image for display, downscaled to at most `max_width`
+# (default: the preview width)
+@lru_cache(maxsize=16)
+def load_sample(path, max_width=None):
+    import cv2
+
+    from rollshift.image import PREVIEW_WIDTH, load_image, make_proxy
+
+    image = cv2.cvtColor(make_proxy(load_image(asset_path(path)), max_width or PREVIEW_WIDTH), cv2.COLOR_BGR2RGB)
+    image.flags.writeable = False
+    return image
+
+
+def profile_path(name):
+    return os.path.join(PROFILES_DIR, f"{name}.cube")
+
+
+# Names of the installed film-stock profiles, sorted
+def list_profiles():
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(PROFILES_DIR) if name.endswith(".cube"))
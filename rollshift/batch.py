@@ -0,0 +1,199 @@
+"""Headless batch converter for whole rolls of film scans.
+
+Usage:
+    python -m rollshift.batch SCANS... -o OUTPUT_DIR [--workers N]
+
+SCANS can be image files, directories or glob patterns. Frames are converted in
+parallel across CPU cores and each positive is written to disk as soon as it is
+done, so memory use stays at one frame per worker.
+
+8- and 16-bit scans are supported; --format tiff (or png) keeps 16-bit data at full depth.
+
+With --roll the film base is estimated once for the whole roll (from a sample of
+frames, or from an unexposed leader scan with --leader), cached as roll_base.json
+in the output directory and reused for every frame. Edit the "overrides" map in
+that file to give individual frames their own base, or "auto" to detect it.
+
+With --stock NAME every frame is converted with that film-stock profile (see
+rollshift.profiles) instead of the automatic colour balance and tone.
+
+With --proofs the roll is only proofed: every scan is reduced to a small proof, the
+proofs are converted together as one stack (see rollshift.proofs), with the
+--stock profile when given, and written as a numbered contact sheet, proofs.jpg,
+in the output directory. Portrait frames of a landscape roll (or the reverse) keep
+their orientation on the sheet, letterboxed.
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rollshift import engine
+from rollshift.filmstrip import contact_sheet
+from rollshift.image import denoise, encode_image, load_image
+from rollshift.pipeline import ConversionPipeline
+from rollshift.profiles import list_profiles, load_profile
+from rollshift.proofs import PROOF_WIDTH, convert_stack, find_base_stack, proof_stack, upright_proofs
+from rollshift.roll import load_or_estimate
+from rollshift.tone import max_value
+
+SCAN_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+OUTPUT_FORMATS = {"jpg": "JPEG", "png": "PNG", "webp": "WebP", "tiff": "TIFF"}  # --format -> encode_image format
+
+
+# Expand files, directories and glob patterns into a sorted list of scan paths
+def collect_scans(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(p for p in candidates if os.path.isfile(p) and p.lower().endswith(SCAN_EXTENSIONS))
+    return sorted(set(paths))
+
+
+def _init_worker():
+    # Parallelism comes from converting one frame per process; keep OpenCV single-threaded
+    engine.load(threads=1)
+
+
+# Convert one scan and write the positive; returns (path, megapixels, stage timings)
+def convert_file(
+    path, output_dir, denoise_strength=3, quality=95, base=None, output_format="jpg", exact_stats=False, stock=None
+):
+    rawscan = load_image(path)
+    pipeline = ConversionPipeline(
+        denoise_strength=denoise_strength, denoiser=denoise, exact_stats=exact_stats,
+        film_profile=None if stock is None else load_profile(stock),
+    )
+    final_image = pipeline.run(rawscan, path, base)[-1][1]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(os.path.join(output_dir, f"{stem}_positive.{output_format}"), "wb") as output_file:
+        output_file.write(encode_image(final_image, OUTPUT_FORMATS[output_format], quality))
+    return path, rawscan.shape[0] * rawscan.shape[1] / 1e6, pipeline.timings
+
+
+def convert_batch(
+    paths, output_dir, workers=None, denoise_strength=3, quality=95, roll=None, output_format="jpg", exact_stats=False,
+    stock=None,
+):
+    """
+    Converts every scan in `paths` into `output_dir` using a process pool.
+
+    When a `RollBase` is given as `roll`, frames are inverted with the roll's base
+    (or their per-frame override) instead of detecting it frame by frame. `stock`
+    names the film-stock profile to convert with, if any.
+
+    Yields (path, megapixels, timings) for each frame as it finishes, or
+    (path, None, error) when a frame fails, so callers can report progress.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(
+                convert_file, path, output_dir, denoise_strength, quality,
+                roll.for_frame(os.path.basename(path)) if roll else None, output_format, exact_stats, stock,
+            ): path
+            for path in paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                yield future.result()
+            except Exception as error:
+                yield path, None, error
+
+
+def write_proofs(paths, output_dir, roll=None, width=PROOF_WIDTH, quality=90, stock=None):
+    """
+    Converts a proof of every scan in `paths` and writes them as a contact sheet.
+
+    With a `RollBase` the proofs use the roll's base (or their per-frame override),
+    scaled to 8 bits; otherwise each proof's base is detected on the proof. `stock`
+    names the film-stock profile to convert with, if any.
+
+    Returns the path of the contact sheet.
+    """
+    depths = []
+
+    def scans():
+        for path in paths:
+            image = load_image(path)
+            depths.append(max_value(image))
+            yield image
+
+    turned = []
+    stack = proof_stack(scans(), width, turned=turned)
+    bases = find_base_stack(stack)
+    if roll is not None:
+        for index, path in enumerate(paths):
+            base = roll.for_frame(os.path.basename(path))
+            if base is not None:
+                bases[index] = base * (255 / depths[index])
+    os.makedirs(output_dir, exist_ok=True)
+    sheet_path = os.path.join(output_dir, "proofs.jpg")
+    with open(sheet_path, "wb") as sheet_file:
+        positives = convert_stack(stack, bases, None if stock is None else load_profile(stock))
+        sheet = contact_sheet(upright_proofs(positives, turned), thumb_width=width)
+        sheet_file.write(encode_image(sheet, "JPEG", quality))
+    return sheet_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert film negative scans to positives.")
+    parser.add_argument("scans", nargs="+", help="Image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="Directory for the converted positives")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--strength", type=int, default=3, help="Denoise strength (default: 3)")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP quality (default: 95)")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default="jpg", help="Output format (default: jpg)")
+    parser.add_argument("--roll", action="store_true", help="Share one film base across all frames")
+    parser.add_argument("--leader", help="Unexposed leader scan to take the roll's base from")
+    parser.add_argument("--roll-samples", type=int, default=6, help="Frames sampled for the roll base (default: 6)")
+    parser.add_argument("--exact-stats", action="store_true",
+                        help="Measure colour balance and gamma statistics on every pixel instead of a sample")
+    parser.add_argument("--stock", choices=list_profiles(), help="Film-stock profile to convert with")
+    parser.add_argument("--proofs", action="store_true",
+                        help="Only write a contact sheet of quick proofs (proofs.jpg) instead of converting the frames")
+    args = parser.parse_args(argv)
+
+    paths = collect_scans(args.scans)
+    if not paths:
+        parser.error("no scans found")
+
+    start = time.perf_counter()
+    roll = None
+    if args.roll or args.leader:
+        roll = load_or_estimate(args.output, paths, args.leader, args.roll_samples)
+        print(f"Roll base (B, G, R): {', '.join(f'{value:.1f}' for value in roll.base)}")
+
+    if args.proofs:
+        sheet_path = write_proofs(paths, args.output, roll, stock=args.stock)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {sheet_path}: {len(paths)} proofs in {elapsed:.1f}s ({len(paths) / elapsed:.1f} frames/s)")
+        return 0
+
+    frames, megapixels, failures = 0, 0.0, 0
+    for path, frame_mp, result in convert_batch(
+        paths, args.output, args.workers, args.strength, args.quality, roll, args.format, args.exact_stats, args.stock
+    ):
+        if frame_mp is None:
+            failures += 1
+            print(f"FAILED {path}: {result}")
+            continue
+        frames += 1
+        megapixels += frame_mp
+        print(f"[{frames}/{len(paths)}] {path} ({frame_mp:.1f} MP, {sum(result.values()):.2f}s)")
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Converted {frames} frames ({megapixels:.1f} MP) in {elapsed:.1f}s: "
+        f"{frames / elapsed:.2f} frames/s, {megapixels / elapsed:.2f} MP/s"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+"""Benchmark suite for the conversion stages and the full pipeline.
+
+Usage:
+    python -m rollshift.benchmark [--sizes 12 24 48 100] [--proofs 36] [--startup-budget 1.0]
+                                  [--output results.json] [--baseline baseline.json] [--save-references]
+
+Every stage (find_base, invert, auto_color_balance, auto_gamma_correction, denoise)
+and the full `ConversionPipeline` run on the images in media/samples and on
+synthetic negatives of the given sizes in megapixels. Wall time, peak RSS and MP/s
+are reported per stage. With --baseline the run fails (exit status 1) when a stage
+got slower than the baseline by more than --max-regression, and the pipeline output
+for each sample is compared against the reference image in benchmarks/reference
+so that speedups can't silently change colours.
+
+Roll proofs (rollshift.proofs) are timed on a synthetic roll of --proofs frames,
+converted one frame at a time and as one stack; the two must give the same pixels.
+
+Start-up is measured in fresh interpreters, as on a cold server: the first render of
+every page (without the background engine preload, see rollshift.engine) and the
+loading of the image engine. The run fails when one of them takes longer than
+--startup-budget seconds, or when a page other than Learn More imports OpenCV before
+a scan is uploaded.
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rollshift.image import (
+    auto_color_balance, auto_gamma_correction, denoise, find_base, invert, load_image, to_uint8,
+)
+from rollshift.metrics import peak_rss_bytes, reset_peak_rss
+from rollshift.pipeline import ConversionPipeline
+from rollshift.proofs import convert_proof, convert_stack, proof_stack
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = os.path.join(REPO_ROOT, "media", "samples", "*negative*")
+REFERENCE_DIR = os.path.join(REPO_ROOT, "benchmarks", "reference")
+SYNTHETIC_SIZES = (12, 24, 48, 100)
+PROOF_FRAMES = 36  # A 36-exposure roll
+STARTUP_BUDGET = 1.0  # Seconds a page's first render or the engine load may take in a fresh process
+# Start-up stage -> (page script, whether its first render may import OpenCV)
+PAGES = {
+    "render_converter": ("1__🎞️_Film_Converting.py", False),
+    "render_development": ("pages/1__🧪_Development_Assistant.py", False),
+    "render_learn_more": ("pages/2__💡_Learn_More.py", True),
+}
+
+# Scripts timed in fresh interpreters; each prints one JSON line
+FIRST_RENDER = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "opencv": "cv2" in sys.modules, "error": len(app.exception) > 0}))
+"""
+ENGINE_LOAD = """
+import json, time
+start = time.perf_counter()
+from rollshift import engine
+engine.load()
+print(json.dumps({"seconds": time.perf_counter() - start, "opencv": True, "error": False}))
+"""
+
+
+# A reproducible negative of about `megapixels` MP: a sample negative scaled up plus grain
+def synthetic_negative(megapixels, seed=0):
+    sample = load_image(sorted(glob.glob(SAMPLES))[0])
+    aspect = sample.shape[1] / sample.shape[0]
+    height = int(round((megapixels * 1e6 / aspect) ** 0.5))
+    negative = cv2.resize(sample, (int(round(height * aspect)), height), interpolation=cv2.INTER_LINEAR)
+    grain = np.random.default_rng(seed).integers(-6, 7, size=negative.shape[:2], dtype=np.int16)
+    for channel in range(3):
+        plane = negative[..., channel].astype(np.int16) + grain
+        negative[..., channel] = np.clip(plane, 0, 255).astype(np.uint8)
+    return negative
+
+
+# `frames` different crops of a synthetic negative, standing in for the frames of a roll
+def synthetic_roll(frames=PROOF_FRAMES, megapixels=12, seed=0):
+    negative = synthetic_negative(megapixels, seed)
+    height, width = negative.shape[0] * 2 // 3, negative.shape[1] * 2 // 3
+    rng = np.random.default_rng(seed)
+    return [
+        negative[y:y + height, x:x + width]
+        for y, x in zip(rng.integers(0, negative.shape[0] - height, frames), rng.integers(0, negative.shape[1] - width, frames))
+    ]
+
+
+def _measure(func, args, repeat):
+    # Best-of-`repeat` wall time and the peak RSS seen across the repeats
+    best, result, peak = float("inf"), None, 0.0
+    for _ in range(repeat):
+        reset_peak_rss()
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, peak_rss_bytes() / (1024 * 1024))
+    return result, best, peak
+
+
+def benchmark_image(image, repeat=1):
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    stages = {}
+
+    def record(name, func, *args):
+        result, seconds, peak = _measure(func, args, repeat)
+        stages[name] = {"seconds": seconds, "peak_rss_mb": peak, "mp_per_s": megapixels / seconds}
+        return result
+
+    base = record("find_base", find_base, image)
+    inverted = record("invert", invert, image, base)
+    balanced = record("auto_color_balance", auto_color_balance, inverted)
+    gamma = record("auto_gamma_correction", auto_gamma_correction, balanced)
+    record("denoise", denoise, gamma)
+    steps = record("pipeline", lambda raw: ConversionPipeline().run(raw, None), image)
+    return {"megapixels": megapixels, "stages": stages}, steps[-1][1]
+
+
+# Proof throughput of a roll converted frame by frame and as one stack
+def benchmark_proofs(frames=PROOF_FRAMES, repeat=1):
+    stack = proof_stack(synthetic_roll(frames))
+    megapixels = stack.shape[0] * stack.shape[1] * stack.shape[2] / 1e6
+    stages = {}
+    outputs = {}
+    for name, func in (("proofs_per_frame", lambda: [convert_proof(frame) for frame in stack]),
+                       ("proofs_stack", lambda: convert_stack(stack))):
+        outputs[name], seconds, peak = _measure(func, (), repeat)
+        stages[name] = {
+            "seconds": seconds, "peak_rss_mb": peak, "mp_per_s": megapixels / seconds, "frames_per_s": frames / seconds,
+        }
+    max_diff = int(np.abs(np.stack(outputs["proofs_per_frame"]).astype(np.int16) - outputs["proofs_stack"]).max())
+    return {"megapixels": megapixels, "frames": frames, "stages": stages, "max_diff": max_diff}
+
+
+def _fresh_process(script, *args):
+    # Run from the repository root, as `streamlit run` would, with the engine preload off
+    completed = subprocess.run(
+        [sys.executable, "-c", script, *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "ROLLSHIFT_PRELOAD": "0"},
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+# Cold-start times: every page's first render and the engine load, each in fresh interpreters
+def benchmark_startup(repeat=1):
+    runs = {name: (FIRST_RENDER, page) for name, (page, _) in PAGES.items()}
+    runs["engine_load"] = (ENGINE_LOAD,)
+    stages = {}
+    for name, command in runs.items():
+        stages[name] = min((_fresh_process(*command) for _ in range(repeat)), key=lambda run: run["seconds"])
+    return {"stages": stages}
+
+
+# Stages that got slower than the baseline by more than `max_regression` (0.2 = 20%);
+# slowdowns below `min_delta` seconds are timer noise and are ignored
+def find_regressions(results, baseline, max_regression, min_delta=0.01):
+    regressions = []
+    for name, result in results.items():
+        for stage, timing in result["stages"].items():
+            previous = baseline.get(name, {}).get("stages", {}).get(stage)
+            if not previous or timing["seconds"] - previous["seconds"] < min_delta:
+                continue
+            if timing["seconds"] > previous["seconds"] * (1 + max_regression):
+                regressions.append((name, stage, previous["seconds"], timing["seconds"]))
+    return regressions
+
+
+def _reference_path(name):
+    return os.path.join(REFERENCE_DIR, os.path.splitext(name)[0] + ".png")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the RollShift conversion stages.")
+    parser.add_argument("--sizes", type=float, nargs="*", default=list(SYNTHETIC_SIZES),
+                        help="Synthetic negative sizes in MP (default: 12 24 48 100)")
+    parser.add_argument("--no-samples", action="store_true", help="Skip the images in media/samples")
+    parser.add_argument("--proofs", type=int, default=PROOF_FRAMES,
+                        help=f"Frames of the synthetic roll for the proof benchmark, 0 to skip (default: {PROOF_FRAMES})")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help=f"Seconds allowed for a cold page render or engine load, 0 to skip (default: {STARTUP_BUDGET:g})")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is kept")
+    parser.add_argument("--output", help="Write the results as JSON (use it as a later --baseline)")
+    parser.add_argument("--baseline", help="Results JSON to compare stage timings against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed slowdown per stage before failing (default: 0.2 = 20%%)")
+    parser.add_argument("--save-references", action="store_true",
+                        help="Store the pipeline outputs of the samples as the new references")
+    parser.add_argument("--min-psnr", type=float, default=40.0,
+                        help="Minimum PSNR in dB against the reference outputs (default: 40)")
+    args = parser.parse_args(argv)
+
+    inputs = [] if args.no_samples else [(os.path.basename(p), p) for p in sorted(glob.glob(SAMPLES))]
+    inputs += [(f"synthetic-{size:g}mp", size) for size in args.sizes]
+
+    results, failed = {}, False
+    for name, source in inputs:
+        image = load_image(source) if isinstance(source, str) else synthetic_negative(source)
+        result, output = benchmark_image(image, args.repeat)
+        del image
+
+        if isinstance(source, str):
+            reference_path = _reference_path(name)
+            if args.save_references:
+                os.makedirs(REFERENCE_DIR, exist_ok=True)
+                cv2.imwrite(reference_path, output)
+            if os.path.exists(reference_path):
+                result["psnr"] = cv2.PSNR(to_uint8(output), to_uint8(load_image(reference_path)))
+                if result["psnr"] < args.min_psnr:
+                    failed = True
+                    print(f"OUTPUT CHANGED {name}: PSNR {result['psnr']:.1f} dB < {args.min_psnr:g} dB")
+        results[name] = result
+
+        print(f"\n{name} ({result['megapixels']:.1f} MP)")
+        for stage, timing in result["stages"].items():
+            print(f"  {stage:<24}{timing['seconds']:>9.3f}s{timing['mp_per_s']:>10.2f} MP/s"
+                  f"{timing['peak_rss_mb']:>10.0f} MB peak")
+        if "psnr" in result:
+            print(f"  {'PSNR vs reference':<24}{result['psnr']:>9.1f} dB")
+
+    if args.proofs:
+        result = results[f"proofs-{args.proofs}"] = benchmark_proofs(args.proofs, args.repeat)
+        stages = result["stages"]
+        print(f"\nproofs ({args.proofs} frames, {result['megapixels']:.1f} MP)")
+        for stage, timing in stages.items():
+            print(f"  {stage:<24}{timing['seconds']:>9.3f}s{timing['frames_per_s']:>10.1f} frames/s"
+                  f"{timing['peak_rss_mb']:>10.0f} MB peak")
+        print(f"  {'stack speedup':<24}{stages['proofs_per_frame']['seconds'] / stages['proofs_stack']['seconds']:>9.2f}x")
+        if result["max_diff"]:
+            failed = True
+            print(f"PROOFS DIFFER: the stack and per-frame proofs differ by up to {result['max_diff']} levels")
+
+    if args.startup_budget:
+        result = results["startup"] = benchmark_startup(args.repeat)
+        print(f"\nstartup (fresh processes, budget {args.startup_budget:g}s)")
+        for stage, timing in result["stages"].items():
+            print(f"  {stage:<24}{timing['seconds']:>9.3f}s{'  imports OpenCV' if timing['opencv'] else ''}")
+            if timing["error"]:
+                failed = True
+                print(f"STARTUP ERROR {stage}: the page raised an exception")
+            if timing["seconds"] > args.startup_budget:
+                failed = True
+                print(f"STARTUP OVER BUDGET {stage}: {timing['seconds']:.3f}s > {args.startup_budget:g}s")
+            if timing["opencv"] and not PAGES.get(stage, (None, True))[1]:
+                failed = True
+                print(f"STARTUP IMPORTS OPENCV {stage}: the page loads the image engine before an upload")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.max_regression)
+        for name, stage, before, after in regressions:
+            print(f"REGRESSION {name} {stage}: {before:.3f}s -> {after:.3f}s")
+        failed = failed or bool(regressions)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,226 @@
+"""Result cache shared by every session, keyed by upload hash and pipeline settings.
+
+Finished conversions (positive, stage previews, timings and every download encoded
+from them so far) are kept in memory in a least-recently-used order under a byte budget. Entries pushed
+out of memory are spilled to disk when a spill directory is set, where another
+byte budget and a maximum age apply; a spilled entry is memory-mapped back on its
+next hit. Large-scan results already live on disk, so they are written out as
+soon as they are cached and only their previews count against the memory budget;
+without a spill directory, their file is deleted when they are evicted.
+
+Settings (environment variables):
+- ROLLSHIFT_CACHE_MB: Memory budget (default: 1024).
+- ROLLSHIFT_SPILL_MB: Disk budget for spilled results, 0 disables spilling (default: 4096).
+- ROLLSHIFT_CACHE_MAX_AGE: Seconds a spilled result is kept after its last use (default: 86400).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rollshift.image import OUTPUT_FORMATS, encode_image
+from rollshift.metrics import REGISTRY, measure, megapixels
+
+RESULT_IMAGE = "denoised.npy"  # Also the name LargeImagePipeline gives its final file
+RESULT_META = "result.json"
+
+
+# Cache key for an upload converted with the given pipeline parameters
+def result_key(upload_key, **params):
+    return hashlib.sha1(repr((upload_key, sorted(params.items()))).encode()).hexdigest()
+
+
+class CachedResult:
+    """
+    A finished conversion.
+
+    Parameters:
+    - image: Full-resolution positive (a memory-mapped array when it lives on disk).
+    - previews: (label, image) previews of every stage, raw scan first.
+    - stages: {stage label: seconds}.
+    - downloads: {(format, quality): encoded bytes} of the downloads encoded so far.
+    """
+
+    def __init__(self, image, previews, stages, downloads=None):
+        self.image = image
+        self.previews = previews
+        self.stages = stages
+        self.downloads = {} if downloads is None else downloads
+
+    @property
+    def nbytes(self):
+        # Memory-mapped images are paged in from disk, so only their previews count
+        image_bytes = 0 if isinstance(self.image, np.memmap) else self.image.nbytes
+        previews = sum(preview.nbytes for _, preview in self.previews)
+        return image_bytes + previews + sum(len(data) for data in self.downloads.values())
+
+
+# Delete the file of a large-scan result (and its work directory once empty). Sessions
+# still showing the result keep their mapping; the disk space is freed when they let go.
+def _remove_result_file(path):
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+def _dir_bytes(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of `CachedResult`s with optional spilling to disk.
+
+    Parameters:
+    - max_bytes: Memory budget (default: ROLLSHIFT_CACHE_MB).
+    - spill_dir: Directory for spilled results, or None to drop evicted entries.
+    - spill_bytes: Disk budget (default: ROLLSHIFT_SPILL_MB).
+    - max_age: Seconds a spilled result is kept after its last use (default: ROLLSHIFT_CACHE_MAX_AGE).
+    """
+
+    def __init__(self, max_bytes=None, spill_dir=None, spill_bytes=None, max_age=None):
+        self.max_bytes = max_bytes or int(os.environ.get("ROLLSHIFT_CACHE_MB", 1024)) * 1024 * 1024
+        spill_mb = int(os.environ.get("ROLLSHIFT_SPILL_MB", 4096))
+        self.spill_dir = spill_dir if spill_mb or spill_bytes else None
+        self.spill_bytes = spill_bytes or spill_mb * 1024 * 1024
+        self.max_age = max_age or float(os.environ.get("ROLLSHIFT_CACHE_MAX_AGE", 24 * 60 * 60))
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "spills": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._trim_disk()
+
+    @property
+    def memory_bytes(self):
+        return self._bytes
+
+    def entry_dir(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return result
+            result = self._load(key) if self.spill_dir else None
+            if result is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._add(key, result)
+            return result
+
+    def download(self, key, result, output_format="JPEG", quality=95, encode=True):
+        """
+        Returns `result` (cached under `key`) encoded for download.
+
+        The file is encoded on the first request and kept with the result, so it is
+        served from memory (or the spill directory) afterwards. With encode=False,
+        returns None instead of encoding a download that isn't cached yet.
+        """
+        if not OUTPUT_FORMATS[output_format][2]:
+            quality = None  # Lossless formats are the same file whatever the quality
+        data = result.downloads.get((output_format, quality))
+        if data is not None or not encode:
+            return data
+        with measure("encode", megapixels(result.image)) as metrics:
+            data = encode_image(result.image, output_format, quality)
+        REGISTRY.record(metrics, key=key, format=output_format, quality=quality)
+        with self._lock:
+            result.downloads[(output_format, quality)] = data
+            if self._entries.get(key) is result:
+                self._entries.pop(key)
+                self._bytes -= result.nbytes - len(data)
+                self._add(key, result)
+        return data
+
+    def put(self, key, result):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).nbytes
+            if self.spill_dir and isinstance(result.image, np.memmap):
+                self._spill(key, result)
+            self._add(key, result)
+
+    def _add(self, key, result):
+        self._entries[key] = result
+        self._bytes += result.nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, old_result = self._entries.popitem(last=False)
+            self._bytes -= old_result.nbytes
+            self.stats["evictions"] += 1
+            if self.spill_dir:
+                self._spill(old_key, old_result)
+            elif isinstance(old_result.image, np.memmap):
+                _remove_result_file(old_result.image.filename)
+
+    def _spill(self, key, result):
+        directory = self.entry_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        image_path = os.path.join(directory, RESULT_IMAGE)
+        on_disk = isinstance(result.image, np.memmap) and result.image.filename == os.path.abspath(image_path)
+        if not (on_disk and os.path.exists(image_path)):
+            np.save(image_path, result.image)
+        np.savez(os.path.join(directory, "previews.npz"), *[preview for _, preview in result.previews])
+        downloads = []
+        for (output_format, quality), data in result.downloads.items():
+            file_name = f"download-{quality or 0}{OUTPUT_FORMATS[output_format][0]}"
+            with open(os.path.join(directory, file_name), "wb") as download_file:
+                download_file.write(data)
+            downloads.append([output_format, quality, file_name])
+        # The metadata file is written last: a directory without it is incomplete
+        meta = {"labels": [label for label, _ in result.previews], "stages": result.stages, "downloads": downloads}
+        with open(os.path.join(directory, RESULT_META), "w") as meta_file:
+            json.dump(meta, meta_file)
+        self.stats["spills"] += 1
+        self._trim_disk()
+
+    def _load(self, key):
+        directory = self.entry_dir(key)
+        meta_path = os.path.join(directory, RESULT_META)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        with np.load(os.path.join(directory, "previews.npz")) as previews:
+            images = [previews[f"arr_{i}"] for i in range(len(meta["labels"]))]
+        downloads = {}
+        for output_format, quality, file_name in meta["downloads"]:
+            with open(os.path.join(directory, file_name), "rb") as download_file:
+                downloads[(output_format, quality)] = download_file.read()
+        os.utime(meta_path)  # Age counts from the last use
+        image = np.load(os.path.join(directory, RESULT_IMAGE), mmap_mode="r")
+        return CachedResult(image, list(zip(meta["labels"], images)), meta["stages"], downloads)
+
+    # Remove spilled results past `max_age`, then the least recently used beyond `spill_bytes`.
+    # Directories without metadata are conversions in progress and only expire by age.
+    def _trim_disk(self):
+        now = time.time()
+        spilled = []
+        for entry in os.scandir(self.spill_dir):
+            if not entry.is_dir():
+                continue
+            meta_path = os.path.join(entry.path, RESULT_META)
+            complete = os.path.exists(meta_path)
+            last_used = os.path.getmtime(meta_path if complete else entry.path)
+            if now - last_used > self.max_age:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif complete:
+                spilled.append((last_used, entry.path, _dir_bytes(entry.path)))
+        total = sum(size for _, _, size in spilled)
+        for _, path, size in sorted(spilled):
+            if total <= self.spill_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
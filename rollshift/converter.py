@@ -0,0 +1,191 @@
+"""The converter page's helpers: downloads, the job queue, progress and film strips.
+
+They need the image engine, so the page imports this module only once a scan is
+uploaded and `rollshift.engine.load()` has run; everything the page draws before
+that lives in rollshift.ui.
+"""
+import cv2
+import streamlit as st
+
+from rollshift.filmstrip import contact_sheet, detect_frames, draw_frames, strip_base, zip_files
+from rollshift.image import OUTPUT_FORMATS, decode_image, encode_image, to_uint8
+from rollshift.jobs import JobQueue, QueueFull, WorkersUnavailable
+from rollshift.metrics import REGISTRY, enable_log
+
+
+# Format and quality pickers plus the download button. Files are only encoded when the
+# user asks for them: `encoded(format, quality)` returns an earlier encoding or None, and
+# the prepare button calls `encode(format, quality)`. `file_name` may use {extension}.
+def show_downloads(
+    encode, encoded, key, prepare_label="Prepare Download ⚙️", label="Download Your Positive 📥",
+    file_name="processed_image{extension}", mime=None,
+):
+    col1, col2 = st.columns(2)
+    with col1:
+        output_format = st.selectbox("Format", list(OUTPUT_FORMATS), key=f"{key}_format")
+    extension, _, lossy = OUTPUT_FORMATS[output_format]
+    with col2:
+        quality = st.slider("Quality", 50, 100, 95, key=f"{key}_quality", disabled=not lossy)
+
+    data = encoded(output_format, quality)
+    if data is None and st.button(prepare_label, key=f"{key}_prepare"):
+        with st.spinner(f"Encoding your {output_format}..."):
+            data = encode(output_format, quality)
+    if data is not None:
+        st.download_button(
+            label=label,
+            data=data,
+            file_name=file_name.format(extension=extension),
+            mime=mime or OUTPUT_FORMATS[output_format][1],
+            key=f"{key}_download",
+        )
+
+
+# One worker pool for every session; conversions run there instead of in the script thread.
+# Per-stage metrics are logged as JSON lines on stderr.
+@st.cache_resource
+def get_job_queue():
+    enable_log()
+    return JobQueue()
+
+
+# Per-stage metrics of the conversion, the server's aggregate metrics and an opt-in
+# profiled re-run of the conversion (cProfile + tracemalloc)
+def show_debug_panel(job, upload_key, data, job_queue, stock=None):
+    with st.expander("🔬 Debug Panel", expanded=True):
+        if job.metrics:
+            st.dataframe(
+                [
+                    {
+                        "Stage": stage.stage,
+                        "MP": round(stage.megapixels, 2),
+                        "Wall (s)": round(stage.wall, 3),
+                        "CPU (s)": round(stage.cpu, 3),
+                        "Peak (MB)": round(stage.peak_bytes / 1e6, 1),
+                        "MP/s": round(stage.megapixels / stage.wall, 1) if stage.wall else None,
+                    }
+                    for stage in job.metrics
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+        else:
+            st.caption("This result came from the cache, so no stages ran.")
+
+        if job.profile is None:
+            if st.button("Profile This Conversion 🧪", help="Runs the conversion again under cProfile and tracemalloc."):
+                try:
+                    st.session_state.job = job_queue.submit(upload_key, data, profile=True, stock=stock)
+                except QueueFull:
+                    st.warning("⏳ The queue is full, try profiling again in a minute.")
+                except WorkersUnavailable:
+                    st.error("Sorry, the converter isn't available right now. Please try again later.")
+                else:
+                    st.rerun()
+        else:
+            st.caption(f"Profiled run: {job.profile['peak_bytes'] / 1e6:.0f} MB peak traced allocations")
+            st.code(job.profile["text"], language="text")
+            st.code(job.profile["allocations"], language="text")
+            st.download_button("Download Profile (.prof) 📊", job.profile["stats"], file_name="rollshift.prof")
+
+        st.caption(f"Server metrics{f' (written to {REGISTRY.path})' if REGISTRY.path else ''}:")
+        st.code(REGISTRY.render(), language="text")
+
+
+# Poll the conversion and show real stage progress; reruns the page once the job is finished
+@st.fragment(run_every=0.5)
+def show_progress(job):
+    if job.finished:
+        st.rerun()
+    if job.status == "queued":
+        st.progress(0.0, text="⏳ Waiting for a free worker...")
+    else:
+        stages = job.stage_names
+        done = len([label for label in job.stages if label in stages])
+        next_stage = stages[min(done, len(stages) - 1)]
+        st.progress(job.progress, text=f"📸 Processing your film... {next_stage} ({done}/{len(stages)})")
+    if job.preview is not None:
+        label, preview = job.preview
+        st.image(cv2.cvtColor(to_uint8(preview), cv2.COLOR_BGR2RGB), caption=label, use_container_width=True)
+
+
+# Film strips: frames and the strip's film base are found once per upload, on a small copy
+@st.cache_data(max_entries=8, show_spinner="🔍 Looking for frames...")
+def find_frames(upload_key, _data):
+    strip = decode_image(_data)
+    base = strip_base(strip)
+    regions = detect_frames(strip, base)
+    return regions, base.tolist(), cv2.cvtColor(draw_frames(strip, regions), cv2.COLOR_BGR2RGB)
+
+
+# Poll the frames of a strip; reruns the page once every frame is finished
+@st.fragment(run_every=0.5)
+def show_strip_progress(jobs):
+    if all(job.finished for job in jobs):
+        st.rerun()
+    done = len([job for job in jobs if job.finished])
+    progress = sum(1.0 if job.finished else job.progress for job in jobs) / len(jobs)
+    st.progress(progress, text=f"📸 Processing your film strip... {done}/{len(jobs)} frames done")
+
+
+# Convert every frame of a strip with one job each, sharing the strip's base (and the
+# film `stock` profile when chosen), then show a contact sheet and offer the positives as one zip
+def show_filmstrip(upload_key, data, job_queue, stock=None):
+    regions, base, outline = find_frames(upload_key, data)
+    st.image(outline, caption=f"{len(regions)} frame(s) found", use_container_width=True)
+    if st.session_state.get("pipeline_upload") != (upload_key, "strip", stock):
+        try:
+            st.session_state.frame_jobs = [
+                job_queue.submit(upload_key, data, region, base, stock=stock) for region in regions
+            ]
+        except QueueFull:
+            st.warning("⏳ RollShift is busy converting other scans right now. Please try again in a minute.")
+            st.stop()
+        except WorkersUnavailable:
+            st.error("Sorry, the converter isn't available right now. Please try again later.")
+            st.stop()
+        st.session_state.pipeline_upload = (upload_key, "strip", stock)
+    jobs = st.session_state.frame_jobs
+
+    if not all(job.finished for job in jobs):
+        show_strip_progress(jobs)
+        st.stop()
+    for number, job in enumerate(jobs, 1):
+        if job.status == "failed":
+            st.error(f"Sorry, frame {number} couldn't be converted ({job.error}).")
+    converted = [(number, job) for number, job in enumerate(jobs, 1) if job.status == "done"]
+    if not converted:
+        st.stop()
+
+    with st.expander("⏱️ Stage Timings"):
+        for number, job in converted:
+            st.write(f"Frame {number}: {sum(job.stages.values()):.2f}s")
+
+    sheet = contact_sheet([job.previews[-1][1] for _, job in converted])
+    st.image(cv2.cvtColor(sheet, cv2.COLOR_BGR2RGB), caption="Contact Sheet", use_container_width=True)
+    st.download_button(
+        label="Download Contact Sheet 🗂️",
+        data=encode_image(sheet, "JPEG", 90),
+        file_name="contact_sheet.jpg",
+        mime="image/jpeg",
+    )
+
+    def frame_files(output_format, quality, encode):
+        extension = OUTPUT_FORMATS[output_format][0]
+        return [
+            (f"frame_{number:02d}{extension}", job_queue.download(job, output_format, quality, encode))
+            for number, job in converted
+        ]
+
+    def encoded_zip(output_format, quality):
+        files = frame_files(output_format, quality, encode=False)
+        return zip_files(files) if all(data is not None for _, data in files) else None
+
+    show_downloads(
+        lambda output_format, quality: zip_files(frame_files(output_format, quality, encode=True)),
+        encoded_zip,
+        key="strip",
+        label="Download All Frames 📦",
+        file_name="rollshift_frames.zip",
+        mime="application/zip",
+    )
@@ -0,0 +1,99 @@
+"""Film development schedules from a catalogue of chemistries.
+
+The processes live in processes.json next to this module; adding a chemistry is a
+matter of adding an entry there. Each process has a list of steps, a developer
+time chart ([temperature °C, seconds] points from the manufacturer's data sheet,
+and optionally the recommended "nominal" temperature, by default the middle of the
+chart) and the push/pull factors it supports. A step either has a fixed time in seconds
+or takes the developer time, which is interpolated on the chart (linearly in log
+time, since development speeds up exponentially with temperature) and scaled by
+the push/pull factor.
+
+Times are only published for the charted temperatures, so the page only offers
+those; a temperature outside the chart gets the time at its nearest end. Developer
+times are tabulated every TEMPERATURE_STEP degrees over TEMPERATURE_RANGE when the
+catalogue is loaded, so a schedule is a table lookup.
+"""
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "processes.json")
+TEMPERATURE_RANGE = (15.0, 45.0)  # °C covered by the developer time tables
+TEMPERATURE_STEP = 0.1  # Resolution of the developer time tables, in °C
+DEFAULT_AGITATION = (60, 10)  # (interval, duration) in seconds for steps that don't set their own
+
+
+class Process:
+    """
+    One chemistry from the catalogue.
+
+    Parameters:
+    - key: Catalogue key of the process.
+    - spec: Its catalogue entry (see processes.json).
+    """
+
+    def __init__(self, key, spec):
+        self.key = key
+        self.name = spec["name"]
+        self.source = spec.get("source", "")
+        self.steps = spec["steps"]
+        self.push_pull = {int(stops): float(factor) for stops, factor in spec["push_pull"].items()}
+        chart = sorted(spec["developer"]["chart"])
+        self.chart = [(float(temperature), float(seconds)) for temperature, seconds in chart]
+        self.chart_range = (self.chart[0][0], self.chart[-1][0])
+        self._nominal = spec["developer"].get("nominal")
+        temperatures = np.arange(round((TEMPERATURE_RANGE[1] - TEMPERATURE_RANGE[0]) / TEMPERATURE_STEP) + 1)
+        self._times = self._developer_times(TEMPERATURE_RANGE[0] + temperatures * TEMPERATURE_STEP)
+        if not any(step.get("developer") for step in self.steps):
+            raise ValueError(f"Process {key!r} has no developer step")
+
+    def _developer_times(self, temperatures):
+        # np.interp holds the end values outside the chart
+        chart_temperatures, chart_seconds = np.array(self.chart).T
+        return np.exp(np.interp(temperatures, chart_temperatures, np.log(chart_seconds)))
+
+    @property
+    def nominal_temperature(self):
+        if self._nominal is not None:
+            return float(self._nominal)
+        return round(sum(self.chart_range) / 2, 1)
+
+    # Whether `temperature` lies on the published chart rather than being clamped to it
+    def on_chart(self, temperature):
+        return self.chart_range[0] - 1e-9 <= temperature <= self.chart_range[1] + 1e-9
+
+    def developer_time(self, temperature, push_pull=0):
+        """
+        Returns the developer time in whole seconds at `temperature` °C.
+
+        Raises ValueError for push/pull settings the process has no factor for.
+        """
+        if push_pull not in self.push_pull:
+            raise ValueError(f"{self.name} has no {push_pull:+} stop push/pull time")
+        index = round((min(max(temperature, TEMPERATURE_RANGE[0]), TEMPERATURE_RANGE[1]) - TEMPERATURE_RANGE[0])
+                      / TEMPERATURE_STEP)
+        return int(round(self._times[index] * self.push_pull[push_pull]))
+
+    def schedule(self, temperature, push_pull=0):
+        """
+        Computes the development steps.
+
+        Returns:
+        - A list of (step name, seconds, agitation interval, agitation duration).
+        """
+        developer = self.developer_time(temperature, push_pull)
+        return [
+            (step["name"], developer if step.get("developer") else step["seconds"],
+             *step.get("agitation", DEFAULT_AGITATION))
+            for step in self.steps
+        ]
+
+
+# The catalogue as {key: Process}, in file order; read once per process
+@lru_cache(maxsize=None)
+def load_catalogue(path=CATALOGUE_PATH):
+    with open(path) as catalogue_file:
+        return {key: Process(key, spec) for key, spec in json.load(catalogue_file).items()}
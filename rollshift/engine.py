@@ -0,0 +1,84 @@
+"""The image engine (OpenCV, NumPy and the conversion modules), imported on first use.
+
+Nothing on a page needs OpenCV before a scan is uploaded, and importing it with
+NumPy and the conversion modules is most of a cold page's start-up. So the pages
+import only Streamlit and the light modules (rollshift.assets, rollshift.ui,
+rollshift.development, rollshift.metrics) at the top, and call `load()` once there
+is something to convert (or `preload()` while waiting for one). The first call in
+a process imports the engine and warms it up:
+- OpenCV's thread count is set (see ROLLSHIFT_CV_THREADS);
+- the calling thread's CLAHE object is created (see rollshift.image);
+- a tiny synthetic negative is encoded, decoded and converted, so the codecs,
+  OpenCV's dispatch, the memoized tone tables and the pipeline's code paths are
+  ready; a cold process otherwise takes about ten times longer over its first
+  conversion than over the next one.
+Later calls return at once. The job queue's worker processes and the batch
+converter's workers load the engine in their initializer.
+
+Settings (environment variables):
+- ROLLSHIFT_CV_THREADS: OpenCV threads per process, which also size `denoise_tiled`'s
+  tile pool (default: the caller's choice, or OpenCV's own of one per core).
+- ROLLSHIFT_PRELOAD: 0 to load the engine only when a scan is uploaded, not in the
+  background while a page waits for one (default: 1).
+"""
+import os
+import threading
+import time
+
+from rollshift.metrics import REGISTRY
+
+CV_THREADS = int(os.environ.get("ROLLSHIFT_CV_THREADS", 0))
+PRELOAD = os.environ.get("ROLLSHIFT_PRELOAD", "1") != "0"
+WARM_UP_SIZE = (64, 48)  # (width, height) of the warm-up negative
+
+_lock = threading.Lock()
+_load_seconds = None  # Seconds the first `load` took, once it has run
+
+
+def _warm_up(threads):
+    # The engine's imports live here, so importing this module stays light
+    import cv2
+    import numpy as np
+
+    from rollshift.image import _clahe, decode_image, encode_image
+    from rollshift.pipeline import ConversionPipeline
+
+    if threads:
+        cv2.setNumThreads(threads)
+    _clahe()
+    width, height = WARM_UP_SIZE
+    negative = np.random.default_rng(0).integers(40, 220, (height, width, 3), dtype=np.uint8)
+    ConversionPipeline().run(decode_image(encode_image(negative, "JPEG")), "warm-up")
+
+
+def load(threads=None):
+    """
+    Imports the image engine and warms it up, once per process.
+
+    Parameters:
+    - threads: OpenCV threads for this process (default: ROLLSHIFT_CV_THREADS, or OpenCV's default).
+
+    Returns:
+    - Seconds the first call spent importing and warming up.
+    """
+    global _load_seconds
+    with _lock:
+        if _load_seconds is None:
+            start = time.perf_counter()
+            _warm_up(threads or CV_THREADS)
+            _load_seconds = time.perf_counter() - start
+            REGISTRY.set_value(
+                "rollshift_engine_load_seconds", _load_seconds, "Seconds spent importing and warming up the image engine."
+            )
+    return _load_seconds
+
+
+def loaded():
+    return _load_seconds is not None
+
+
+# Start loading the engine in a background thread (e.g. once a page has rendered and
+# waits for an upload), unless it is loaded or loading already or preloading is off
+def preload(threads=None):
+    if PRELOAD and not loaded() and not _lock.locked():
+        threading.Thread(target=load, args=(threads,), daemon=True).start()
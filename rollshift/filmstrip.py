@@ -0,0 +1,180 @@
+"""Frame detection for scans that hold a whole strip of film.
+
+A flatbed scan of a strip holds several frames separated by unexposed film: the
+inter-frame gaps and the rebate along the edges show the bare film base, which is
+the brightest colour on the negative. `detect_frames` marks every pixel that is
+clearly darker than the base as exposed, trims the rebate rows, and splits the
+strip at the columns that carry (almost) no exposure. All of this runs on a
+downscaled copy, so it takes a fraction of a second even on very large strips.
+
+The frames of one strip share their film, so they are converted with the base
+measured once on the whole strip (`strip_base`); `contact_sheet` and `zip_files`
+package the positives for download.
+"""
+import io
+import zipfile
+
+import cv2
+import numpy as np
+
+from rollshift.image import find_base, to_uint8
+from rollshift.tone import max_value
+
+DETECT_SIZE = 1000  # Long edge of the copy frame detection runs on
+HOLE_MARGIN = 3  # Pixels of the detection copy left out around sprocket holes
+MAX_HOLE_AREA = 0.15  # Largest fraction of a strip sprocket holes cover
+
+
+def _detect_copy(image):
+    scale = min(DETECT_SIZE / max(image.shape[:2]), 1.0)
+    if scale == 1.0:
+        return image, scale
+    size = (max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+# Film base of a strip: sprocket holes let the scanner light through unfiltered and
+# are brighter than the base, so they (and their soft edges) are left out of the estimate.
+# A near-white area larger than holes can be is the base itself (clear B&W film).
+def strip_base(image, percentile=99.0):
+    small, _ = _detect_copy(image)
+    holes = (small >= max_value(small) * 0.9).all(axis=2)
+    if holes.mean() > MAX_HOLE_AREA:
+        return find_base(small, percentile)
+    holes = cv2.dilate(holes.view(np.uint8), np.ones((HOLE_MARGIN * 2 + 1,) * 2, np.uint8)).view(bool)
+    small = small.copy()
+    small[holes] = 0
+    return find_base(small, percentile)
+
+
+# Index ranges [start, stop) of the True runs in a 1-D boolean array
+def _runs(mask):
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+# First and last index along a profile that reach `threshold`, or None
+def _extent(profile, threshold):
+    above = np.flatnonzero(profile >= threshold)
+    return (above[0], above[-1] + 1) if len(above) else None
+
+
+def detect_frames(image, base=None, tolerance=0.15, gap_exposure=0.1, rebate_exposure=0.2, min_frame=0.3, min_gap=3):
+    """
+    Finds the frames of a film strip scan.
+
+    The strip may run horizontally or vertically; frames are returned in strip order
+    (left to right, or top to bottom).
+
+    Parameters:
+    - image: 8- or 16-bit BGR negative.
+    - base: (B, G, R) film base (default: `strip_base(image)`).
+    - tolerance: How much darker than the base (as a fraction of it) a pixel must be to count as exposed.
+    - gap_exposure: Columns with less than this fraction of exposed pixels are gaps between frames.
+    - rebate_exposure: Rows with less than this fraction of exposed pixels are rebate.
+    - min_frame: Shortest frame, as a fraction of the strip's width across.
+    - min_gap: Narrowest gap in pixels of the detection copy; narrower ones are dark
+      lines within a frame.
+
+    Returns:
+    - A list of (x, y, width, height) regions, the whole image when no gaps are found.
+    """
+    base = strip_base(image) if base is None else np.asarray(base, dtype=np.float64)
+    small, scale = _detect_copy(image)
+    exposed = (small < base * (1 - tolerance)).any(axis=2)
+    vertical = exposed.shape[0] > exposed.shape[1]
+    if vertical:
+        exposed = exposed.T  # Work on a horizontal strip and swap the axes back at the end
+
+    band = _extent(exposed.mean(axis=1), rebate_exposure)
+    if band is None:
+        return [(0, 0, image.shape[1], image.shape[0])]
+    columns = exposed[band[0]:band[1]].mean(axis=0) >= gap_exposure
+    # Close gaps too narrow to be between frames, then keep the runs long enough to be frames
+    for start, stop in _runs(~columns):
+        if stop - start < min_gap and start > 0 and stop < len(columns):
+            columns[start:stop] = True
+    min_length = min_frame * (band[1] - band[0])
+    runs = [(start, stop) for start, stop in _runs(columns) if stop - start >= min_length]
+    if len(runs) < 2:
+        return [(0, 0, image.shape[1], image.shape[0])]
+
+    regions = []
+    for start, stop in runs:
+        rows = _extent(exposed[:, start:stop].mean(axis=1), rebate_exposure) or band
+        x, y = int(start / scale), int(rows[0] / scale)
+        width, height = int(np.ceil(stop / scale)) - x, int(np.ceil(rows[1] / scale)) - y
+        regions.append((y, x, height, width) if vertical else (x, y, width, height))
+    full_height, full_width = image.shape[:2]
+    return [
+        (x, y, min(width, full_width - x), min(height, full_height - y)) for x, y, width, height in regions
+    ]
+
+
+def crop(image, region):
+    x, y, width, height = region
+    return np.ascontiguousarray(image[y:y + height, x:x + width])
+
+
+# Outline the detected frames on a display copy of the strip
+def draw_frames(image, regions, max_size=DETECT_SIZE):
+    scale = min(max_size / max(image.shape[:2]), 1.0)
+    size = (max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1))
+    outlined = cv2.resize(to_uint8(image), size, interpolation=cv2.INTER_AREA)
+    thickness = max(size[0], size[1]) // 300 + 1
+    for number, (x, y, width, height) in enumerate(regions, 1):
+        top_left = (int(x * scale), int(y * scale))
+        cv2.rectangle(outlined, top_left, (int((x + width) * scale), int((y + height) * scale)), (0, 0, 255), thickness)
+        cv2.putText(
+            outlined, str(number), (top_left[0] + 4 * thickness, top_left[1] + 12 * thickness),
+            cv2.FONT_HERSHEY_SIMPLEX, thickness * 0.4, (0, 0, 255), thickness,
+        )
+    return outlined
+
+
+def contact_sheet(images, columns=3, thumb_width=480, padding=24):
+    """
+    Lays positives out on a numbered contact sheet.
+
+    Parameters:
+    - images: 8- or 16-bit BGR images, in frame order.
+    - columns: Frames per row.
+    - thumb_width: Width of each frame on the sheet.
+    - padding: Space around the frames, which also holds the frame numbers.
+
+    Returns:
+    - An 8-bit BGR image.
+    """
+    thumbs = [
+        cv2.resize(to_uint8(image), (thumb_width, max(int(round(image.shape[0] * thumb_width / image.shape[1])), 1)),
+                   interpolation=cv2.INTER_AREA)
+        for image in images
+    ]
+    columns = max(min(columns, len(thumbs)), 1)
+    rows = [thumbs[i:i + columns] for i in range(0, len(thumbs), columns)]
+    row_heights = [max(thumb.shape[0] for thumb in row) for row in rows]
+    sheet = np.full(
+        (sum(row_heights) + padding * (len(rows) + 1), columns * thumb_width + padding * (columns + 1), 3),
+        20, dtype=np.uint8,
+    )
+    y = padding
+    number = 1
+    for row, row_height in zip(rows, row_heights):
+        x = padding
+        for thumb in row:
+            sheet[y:y + thumb.shape[0], x:x + thumb_width] = thumb
+            cv2.putText(sheet, str(number), (x, y - padding // 4), cv2.FONT_HERSHEY_SIMPLEX,
+                        padding / 48, (200, 200, 200), 1, cv2.LINE_AA)
+            x += thumb_width + padding
+            number += 1
+        y += row_height + padding
+    return sheet
+
+
+# Zip archive of (file name, bytes) pairs; the images are already compressed, so they are stored as-is
+def zip_files(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    return buffer.getvalue()
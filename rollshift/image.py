@@ -0,0 +1,381 @@
+"""Image processing functions for converting film negatives to positives.
+
+Every function works on BGR arrays as returned by `load_image` / `decode_image`,
+either 8-bit (uint8) or 16-bit (uint16) per channel, and returns the same depth it
+was given. Nothing here has Streamlit side effects, so the module is shared by the
+pages and the batch CLI.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from rollshift.stats import ImageStats
+from rollshift.tone import (
+    apply_lut, dynamic_lut_table, gamma_lut, invert_lut, max_value, rgb_lut, scale_lut, tone_curve,
+)
+
+
+# Decode uploaded bytes into a BGR image, keeping 16-bit data at full depth
+def decode_image(data):
+    return _as_bgr(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED))
+
+
+def load_image(path):
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Could not read image: {path}")
+    return _as_bgr(image)
+
+
+def _as_bgr(image):
+    if image is None:
+        raise ValueError("Unsupported or corrupt image file")
+    if image.dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"Unsupported image depth: {image.dtype}")
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+# 8-bit copy of an image for display and JPEG export
+def to_uint8(image):
+    if image.dtype == np.uint8:
+        return image
+    return cv2.convertScaleAbs(image, alpha=255 / 65535)
+
+
+# Function to find base color using the 99th percentile of brightness
+# A 766-bin histogram of the uint16 brightness sums (0..765) locates the cut-off in
+# linear time instead of sorting every pixel; pixels tied at the cut-off are averaged
+# in proportionally so the result matches the top-N mean. Use stride > 1 to estimate
+# from a subsampled grid on very large scans. 16-bit pixels are ranked by their 8-bit
+# brightness and averaged at full depth.
+def find_base(neg, percentile=99.0, stride=1):
+    if stride > 1:
+        neg = np.ascontiguousarray(neg[::stride, ::stride])
+    brightness = _brightness(neg)  # Compute brightness for each pixel
+    count = max(int((100 - percentile) / 100 * brightness.size), 1)  # Number of brightest pixels to sample
+
+    threshold, n_brighter = _base_cutoff(_brightness_histogram(brightness), count)
+    total = _base_sums(neg, brightness, threshold)
+    return (total[0] + total[1] * (count - n_brighter)) / count  # Returns (B, G, R) as a NumPy array
+
+
+def _brightness(neg):
+    b, g, r = cv2.split(neg)
+    if neg.dtype == np.uint16:
+        b, g, r = b >> 8, g >> 8, r >> 8
+    return cv2.add(cv2.add(b, g, dtype=cv2.CV_16U), r, dtype=cv2.CV_16U)
+
+
+def _brightness_histogram(brightness):
+    return cv2.calcHist([brightness], [0], None, [766], [0, 766]).ravel()
+
+
+# Brightness cut-off for the `count` brightest pixels and how many lie strictly above it
+def _base_cutoff(hist, count):
+    brighter_counts = np.cumsum(hist[::-1])  # brighter_counts[i]: pixels with brightness >= 765 - i
+    threshold = 765 - int(np.searchsorted(brighter_counts, count))
+    n_brighter = int(brighter_counts[764 - threshold]) if threshold < 765 else 0
+    return threshold, n_brighter
+
+
+# (B, G, R) sums of the pixels above the cut-off, and the mean of those tied at it
+def _base_sums(neg, brightness, threshold):
+    above = brightness > threshold
+    n_above = cv2.countNonZero(above.view(np.uint8))
+    above_sum = np.array(cv2.mean(neg, mask=above.view(np.uint8))[:3]) * n_above if n_above else np.zeros(3)
+    tied_mean = np.array(cv2.mean(neg, mask=(brightness == threshold).view(np.uint8))[:3])
+    return above_sum, tied_mean
+
+
+
+# Function to invert the negative image with enhanced color balancing
+def invert(neg, base):
+    return apply_lut(neg, invert_lut(base, neg.dtype))
+
+# Function to apply gamma correction (tables are memoized in rollshift.tone)
+def adjust_gamma(image, gamma):
+    return apply_lut(image, gamma_lut(gamma, image.dtype))
+
+# Global statistics: the automatic adjustments below take an optional `ImageStats` of
+# their input and otherwise measure one on a sample of it (see rollshift.stats)
+
+#auto gamma correction
+def auto_gamma_correction(image, stats=None):
+    # Mean brightness on the 8-bit scale, whatever the image depth
+    mean_intensity = (stats or ImageStats(image)).gray_mean * 255 / max_value(image)
+    gamma = np.clip(1.5 - (mean_intensity / 128), 0.4, 2.5)  # Adjust dynamically
+    return adjust_gamma(image, gamma)
+
+
+# Function to apply white balance using Gray World Assumption
+def gray_world_scales(image, stats=None):
+    avg_b, avg_g, avg_r = (stats or ImageStats(image)).channel_means
+    avg_gray = (avg_b + avg_g + avg_r) / 3  # Calculate average intensity (gray)
+    return avg_gray / avg_b, avg_gray / avg_g, avg_gray / avg_r  # Scaling factors
+
+def apply_white_balance(image, stats=None):
+    return apply_lut(image, scale_lut(gray_world_scales(image, stats), image.dtype))
+
+def white_patch_scales(image, stats=None):
+    max_b, max_g, max_r = (stats or ImageStats(image)).channel_max
+    top = max_value(image)
+    return top / max_b, top / max_g, top / max_r
+
+def white_patch_retinex(image, stats=None):
+    return apply_lut(image, scale_lut(white_patch_scales(image, stats), image.dtype))
+
+
+# OpenCV converts only 8-bit and float images to LAB, so 16-bit images go through a
+# float32 LAB image (L in 0..100, a/b centred on 0) and back.
+def _to_lab_float(image):
+    return cv2.cvtColor(image.astype(np.float32) * (1 / 65535), cv2.COLOR_BGR2LAB)
+
+def _from_lab_float(lab):
+    bgr = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    return np.clip(bgr * 65535 + 0.5, 0, 65535).astype(np.uint16)
+
+def _to_lab(image):
+    return _to_lab_float(image) if image.dtype == np.uint16 else cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+
+def _from_lab(lab):
+    return _from_lab_float(lab) if lab.dtype == np.float32 else cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+# CLAHE objects keep working buffers between calls, so each thread reuses its own
+_clahe_cache = threading.local()
+
+def _clahe():
+    clahe = getattr(_clahe_cache, "clahe", None)
+    if clahe is None:
+        clahe = _clahe_cache.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))  # Adjust clipLimit to control contrast
+    return clahe
+
+def _clahe_float_l(l, clahe):
+    # CLAHE's clip limit is spread over the histogram bins, so a 65536-bin histogram
+    # barely equalises anything; equalise the 8-bit L and add the shift to the exact L
+    l8 = cv2.convertScaleAbs(l, alpha=2.55)
+    shift = clahe.apply(l8).astype(np.float32) - l8
+    return np.clip(l + shift * (1 / 2.55), 0, 100)
+
+def _equalize_l(l):
+    return _clahe_float_l(l, _clahe()) if l.dtype == np.float32 else _clahe().apply(l)
+
+# Shift the a/b planes so their means (`ImageStats.lab_ab_means`) land on neutral:
+# 128 in 8-bit LAB (through a 256-entry table), 0 in float LAB
+def _neutral_ab(a, b, means):
+    if a.dtype == np.uint8:
+        return [cv2.LUT(plane, np.clip(np.arange(256) - (mean - 128), 0, 255).astype(np.uint8))
+                for plane, mean in zip((a, b), means)]
+    return [np.clip(plane - mean, -127, 127) for plane, mean in zip((a, b), means)]
+
+def apply_clahe(image):
+    l, a, b = cv2.split(_to_lab(image))
+    return _from_lab(cv2.merge([_equalize_l(l), a, b]))
+
+# Function to adjust RGB channels
+def adjust_rgb(image, r_factor, g_factor, b_factor):
+    return apply_lut(image, rgb_lut(r_factor, g_factor, b_factor, image.dtype))
+
+# Gamma and RGB factors fused into one memoized table for the manual adjustment sliders
+def adjust_gamma_rgb(image, gamma, r_factor, g_factor, b_factor):
+    return apply_lut(image, tone_curve(image.dtype, gamma, r_factor, g_factor, b_factor))
+
+
+# Function to sharpen image
+def sharp(image):
+    kernel = np.array([[0, -0.25, 0],
+                    [-0.25, 2, -0.25],
+                    [0, -0.25, 0]])
+    sharp_img = cv2.filter2D(image, -1, kernel)
+    return sharp_img
+
+
+def apply_lab_white_balance(image, stats=None):
+    l, a, b = cv2.split(_to_lab(image))
+    a, b = _neutral_ab(a, b, (stats or ImageStats(image)).lab_ab_means)  # Auto-correct the red-green and blue-yellow balance
+    return _from_lab(cv2.merge([l, a, b]))
+
+# Adaptive shadows/midtones/highlights curve from the brightness CDF, applied to each channel
+def dynamic_lut(image, stats=None):
+    return apply_lut(image, dynamic_lut_table((stats or ImageStats(image)).gray_histogram, image.dtype))
+
+# LAB white balance and CLAHE fused into one trip through LAB: the a/b means are
+# shifted to neutral and the L channel equalised before converting back once
+def auto_color_balance(image, stats=None):
+    l, a, b = cv2.split(_to_lab(image))
+    a, b = _neutral_ab(a, b, (stats or ImageStats(image)).lab_ab_means)
+    return _from_lab(cv2.merge([_equalize_l(l), a, b]))
+
+
+# Apply CLAHE to enhance the L-channel (brightness) without overexposing
+def contrast_adjust(image):
+    return apply_clahe(image)
+
+
+def blur(image, kernel_size=(9, 9)):
+    """
+    Applies a slight Gaussian blur to smooth the image.
+
+    Parameters:
+    - image: Input image to be blurred.
+    - kernel_size: The size of the Gaussian kernel (default is (5, 5)).
+
+    Returns:
+    - Blurred image.
+    """
+    return cv2.GaussianBlur(image, kernel_size, 0)
+
+def denoise(image, strength=3):
+    """
+    Reduces noise in the image using Non-Local Means Denoising.
+
+    16-bit images are filtered in YCrCb with the L1 norm, the only 16-bit mode OpenCV
+    offers, with the strength scaled to the 16-bit range.
+    """
+    if image.dtype == np.uint8:
+        return cv2.fastNlMeansDenoisingColored(image, None, strength, strength, 7, 21)
+    ycrcb = _nlm(cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb), strength)
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+
+
+def _nlm(image, strength):
+    # Non-Local Means on a 1-4 channel image of either depth
+    if image.dtype == np.uint8:
+        return cv2.fastNlMeansDenoising(image, None, strength, 7, 21)
+    h = np.full(image.shape[2] if image.ndim == 3 else 1, strength * 257.0, dtype=np.float32)
+    return cv2.fastNlMeansDenoising(image, h, None, 7, 21, cv2.NORM_L1)
+
+
+def _denoise_chroma(image, strength):
+    # NLM on the colour channels only, at half resolution; luminance grain is kept.
+    # 16-bit images use YCrCb since OpenCV's LAB conversion is 8-bit/float only.
+    if image.dtype == np.uint8:
+        to_luma_chroma, from_luma_chroma = cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR
+    else:
+        to_luma_chroma, from_luma_chroma = cv2.COLOR_BGR2YCrCb, cv2.COLOR_YCrCb2BGR
+    # Odd edges are padded by one replicated pixel so the half-resolution grid is an
+    # exact 2x one; tiles starting on even coordinates then share the full frame's grid.
+    l, a, b = cv2.split(cv2.cvtColor(image, to_luma_chroma))
+    height, width = l.shape
+    ab = cv2.copyMakeBorder(cv2.merge([a, b]), 0, height % 2, 0, width % 2, cv2.BORDER_REPLICATE)
+    ab = cv2.resize(ab, ((width + 1) // 2, (height + 1) // 2), interpolation=cv2.INTER_AREA)
+    ab = _nlm(ab, strength)
+    ab = cv2.resize(ab, ((width + 1) // 2 * 2, (height + 1) // 2 * 2), interpolation=cv2.INTER_LINEAR)
+    a, b = cv2.split(ab[:height, :width])
+    return cv2.cvtColor(cv2.merge([l, a, b]), from_luma_chroma)
+
+
+def _denoise_bilateral(image, strength):
+    if image.dtype == np.uint8:
+        return cv2.bilateralFilter(image, 9, strength * 10, 9)
+    # bilateralFilter takes 8-bit or float input; the weighted mean stays in range
+    filtered = cv2.bilateralFilter(image.astype(np.float32), 9, strength * 10 * 257, 9)
+    return (filtered + 0.5).astype(np.uint16)
+
+
+# Tile filters and the overlap each needs so that cropped tiles match the full-frame result
+DENOISE_MODES = {
+    "nlm": (denoise, 13),  # 7 px template + 21 px search window
+    "chroma": (_denoise_chroma, 32),  # NLM footprint at half resolution plus resampling
+    "bilateral": (_denoise_bilateral, 4),  # 9 px diameter
+}
+
+
+def denoise_tiled(image, strength=3, tile_size=512, workers=None, mode="nlm", out=None):
+    """
+    Reduces noise like `denoise`, but splits the image into tiles that are denoised in
+    parallel on a thread pool (OpenCV releases the GIL while filtering).
+
+    Each tile is filtered with an overlap as wide as the filter's footprint and cropped
+    back, so the seams between tiles match a single full-frame pass.
+
+    Parameters:
+    - image: Input image to be denoised.
+    - strength: Filter strength, as in `denoise`.
+    - tile_size: Edge length of the tiles before the overlap is added.
+    - workers: Number of worker threads (default: OpenCV's thread count, one per CPU core
+      unless a process sets its share, as the job queue's and batch workers do).
+    - mode: "nlm" for the full Non-Local Means filter, "chroma" for a fast NLM on the
+      downscaled colour channels only, or "bilateral" for the fastest bilateral filter.
+    - out: Optional array (e.g. a memory-mapped file) to write the result into.
+
+    Returns:
+    - Denoised image.
+    """
+    tile_filter, margin = DENOISE_MODES[mode]
+    tile_size += tile_size % 2  # Even tile origins keep the chroma filter's 2x grid aligned
+    height, width = image.shape[:2]
+    result = np.empty_like(image) if out is None else out
+
+    def denoise_tile(origin):
+        y0, x0 = origin
+        y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+        top, left = max(y0 - margin, 0), max(x0 - margin, 0)
+        bottom, right = min(y1 + margin, height), min(x1 + margin, width)
+        tile = tile_filter(image[top:bottom, left:right], strength)
+        result[y0:y1, x0:x1] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    origins = [(y, x) for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    with ThreadPoolExecutor(max_workers=workers or max(cv2.getNumThreads(), 1)) as pool:
+        list(pool.map(denoise_tile, origins))
+    return result
+
+
+# Manual Mode previews: slider adjustments are applied to a downscaled proxy of the
+# processed image so each slider tick stays fast; the full-resolution image is only
+# adjusted when the user asks for the download.
+PREVIEW_WIDTH = 1400  # 2x the ~700 px preview column, sharp on high-DPI screens
+
+def make_proxy(image, max_width=PREVIEW_WIDTH):
+    height, width = image.shape[:2]
+    if width <= max_width:
+        return image
+    proxy_height = max(int(round(height * max_width / width)), 1)
+    return cv2.resize(image, (max_width, proxy_height), interpolation=cv2.INTER_AREA)
+
+
+# Download formats: name -> (extension, MIME type, takes a quality setting).
+# JPEG and WebP are 8-bit, PNG keeps the image depth and TIFF is always 16-bit.
+OUTPUT_FORMATS = {
+    "JPEG": (".jpg", "image/jpeg", True),
+    "PNG": (".png", "image/png", False),
+    "WebP": (".webp", "image/webp", True),
+    "TIFF": (".tiff", "image/tiff", False),
+}
+
+def encode_image(image, output_format="JPEG", quality=95):
+    """
+    Encodes an image for download with OpenCV's encoders.
+
+    Parameters:
+    - image: 8- or 16-bit BGR image.
+    - output_format: One of OUTPUT_FORMATS.
+    - quality: 1-100 for JPEG and WebP, ignored by the lossless formats.
+
+    Returns:
+    - The encoded file as bytes.
+    """
+    extension = OUTPUT_FORMATS[output_format][0]
+    params = []
+    if output_format == "JPEG":
+        image, params = to_uint8(image), [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif output_format == "WebP":
+        image, params = to_uint8(image), [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif output_format == "TIFF" and image.dtype == np.uint8:
+        image = image.astype(np.uint16) * 257  # 8-bit images are scaled up so the file is always 16-bit
+    ok, buf = cv2.imencode(extension, np.ascontiguousarray(image), params)
+    if not ok:
+        raise ValueError(f"Could not encode {output_format}")
+    return buf.tobytes()
+
+def encode_jpeg(image, quality=95):
+    return encode_image(image, "JPEG", quality)
+
+# 16-bit TIFF export
+def encode_tiff(image):
+    return encode_image(image, "TIFF")
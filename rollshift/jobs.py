@@ -0,0 +1,337 @@
+"""Background conversion jobs for the Streamlit app.
+
+Uploads are converted in a pool of worker processes, so a big scan doesn't hold a
+Streamlit script thread for the whole pipeline and concurrent users don't queue up
+behind one interpreter. Workers report every finished stage (with a downscaled
+preview) through a queue that a listener thread folds into the job's state for the
+page to poll. Finished conversions go into a `ResultCache` keyed by upload hash
+and pipeline settings, so a reload, a re-download or a second user with the same
+scan gets the result at once. The frames of a film strip (see rollshift.filmstrip)
+are submitted as one job each, with their region of the scan and the strip's base.
+A job can convert with a film-stock profile (see rollshift.profiles) instead of
+the automatic stages.
+Per-stage metrics of every conversion are recorded in rollshift.metrics.REGISTRY;
+a job can also be submitted with profiling on (see `profile_run`).
+
+Workers import and warm up the image engine (see rollshift.engine) as they start,
+each with an even share of the CPU cores for OpenCV's threads, which also sizes the
+denoise stage's tile pool (see rollshift.image.denoise_tiled).
+
+Settings (environment variables, see also rollshift.cache and rollshift.engine):
+- ROLLSHIFT_WORKERS: Worker processes (default: 2).
+- ROLLSHIFT_QUEUE_DEPTH: Jobs that may be queued or running at once (default: 8).
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+import numpy as np
+
+from rollshift import engine
+from rollshift.cache import CachedResult, ResultCache, result_key
+from rollshift.filmstrip import crop
+from rollshift.image import decode_image, make_proxy
+from rollshift.large import LargeImagePipeline, banded_shape, decode_to_memmap, to_memmap
+from rollshift.metrics import REGISTRY, profile_run
+from rollshift.pipeline import ConversionPipeline
+from rollshift.profiles import load_profile
+
+LARGE_SCAN_MP = 60  # Scans above this size are converted from memory-mapped files
+RESULTS_DIR = os.path.join("temp", "results")  # Spilled results and large-scan work files
+STAGES = ("Base Detection", "Inverted Image", "Color Balanced Image", "Gamma Corrected Image", "Denoised Image")
+PROFILE_STAGES = ("Base Detection", "Film Profile", "Denoised Image")  # Stages of a conversion with a film profile
+
+_events = None  # Worker side of the progress queue, set by _init_worker
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds its maximum number of unfinished jobs."""
+
+
+class WorkersUnavailable(Exception):
+    """Raised when no worker process can be started to take a job."""
+
+
+def _init_worker(events, threads):
+    global _events
+    _events = events
+    engine.load(threads)
+
+
+# Streamlit installs the page script as __main__, and spawned processes re-run their
+# parent's main script on start-up; hide it while the pool launches its workers
+@contextmanager
+def _without_main_script():
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+# Convert one upload (or the `region` of it holding one frame, inverted with the film
+# `base` when given, with the profile of film `stock` when given) in a worker process;
+# returns (previews, final image or .npy path, timings, StageMetrics of the stages,
+# profile report or None)
+def convert_upload(
+    key, data, denoise_strength=3, temp_dir=RESULTS_DIR, region=None, base=None, profile=False, stock=None
+):
+    # Large scans run from memory-mapped files in the work directory. A profiling run
+    # gets its own, as a cached result of the same key may be memory-mapped from
+    # <key>/; the previous run's files are unlinked rather than rewritten, so a job
+    # still holding them keeps its image
+    workdir = os.path.join(temp_dir, f"{key}-profile" if profile else key)
+    if profile:
+        shutil.rmtree(workdir, ignore_errors=True)
+    raw_path = os.path.join(workdir, "raw.npy")
+    shape = banded_shape(data) if region is None else None
+    if shape is not None and shape[0] * shape[1] > LARGE_SCAN_MP * 1e6:
+        rawscan = decode_to_memmap(data, raw_path)  # A large TIFF goes to disk band by band
+    else:
+        rawscan = decode_image(data)
+        if region is not None:
+            rawscan = crop(rawscan, region)
+    previews = [("Raw Scan", make_proxy(rawscan))]
+
+    def on_stage(label, image, seconds):
+        preview = make_proxy(image) if getattr(image, "ndim", 0) == 3 else None
+        if preview is not None:
+            previews.append((label, preview))
+        if _events is not None:
+            _events.put((key, label, seconds, preview))
+
+    if _events is not None:
+        _events.put((key, "Raw Scan", None, previews[0][1]))
+    if base is not None:
+        on_stage("Base Detection", base, 0.0)  # Shared base: nothing to detect
+
+    film_profile = None if stock is None else load_profile(stock)
+    large = rawscan.shape[0] * rawscan.shape[1] > LARGE_SCAN_MP * 1e6
+    if large:
+        # Large-scan mode: the result stays on disk and is handed back as a path
+        if not isinstance(rawscan, np.memmap):
+            rawscan = to_memmap(rawscan, raw_path)
+        pipeline = LargeImagePipeline(
+            workdir, denoise_strength=denoise_strength, on_stage=on_stage, film_profile=film_profile
+        )
+        args = (rawscan, None, base)
+    else:
+        pipeline = ConversionPipeline(denoise_strength=denoise_strength, on_stage=on_stage, film_profile=film_profile)
+        args = (rawscan, key, base)
+    report = None
+    if profile:
+        steps, report = profile_run(pipeline.run, *args)
+    else:
+        steps = pipeline.run(*args)
+    final = steps[-1][1]
+    if large:
+        del rawscan, args, steps
+        os.remove(raw_path)
+        # denoised.npy is already where the cache keeps the image of a spilled result
+        final = final.filename
+    return previews, final, pipeline.timings, pipeline.metrics, report
+
+
+class Job:
+    """
+    State of one conversion, updated from the worker's progress events.
+
+    Attributes:
+    - status: "queued", "running", "done" or "failed".
+    - stage_names: Labels of the stages the conversion runs, in order.
+    - stages: {stage label: seconds} for the stages finished so far.
+    - preview: (label, image) preview of the latest finished stage.
+    - previews: (label, image) previews of every stage once done, raw scan first.
+    - image: The full-resolution positive once done (memory-mapped for large scans).
+    - result: The `CachedResult` once done; see `JobQueue.download`.
+    - metrics: `StageMetrics` of every stage once done; empty for cached results.
+    - profile: Report of `profile_run` for jobs submitted with profile=True.
+    - error: Error message when the conversion failed.
+    """
+
+    def __init__(self, key, stage_names=STAGES):
+        self.key = key
+        self.status = "queued"
+        self.stage_names = stage_names
+        self.stages = {}
+        self.preview = None
+        self.previews = []
+        self.image = None
+        self.result = None
+        self.metrics = []
+        self.profile = None
+        self.error = None
+        self.submitted = time.time()
+
+    # A finished job for a result served from the cache
+    @classmethod
+    def from_result(cls, key, result):
+        job = cls(key)
+        job._set_result(result)
+        return job
+
+    def _set_result(self, result):
+        self.result = result
+        self.image, self.previews, self.stages = result.image, result.previews, result.stages
+        self.preview = result.previews[-1]
+        self.status = "done"
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def progress(self):
+        return len([label for label in self.stages if label in self.stage_names]) / len(self.stage_names)
+
+
+class JobQueue:
+    """
+    Process pool that converts uploads in the background.
+
+    Parameters:
+    - workers: Worker processes (default: ROLLSHIFT_WORKERS or 2).
+    - max_pending: Unfinished jobs accepted before `submit` raises QueueFull
+      (default: ROLLSHIFT_QUEUE_DEPTH or 8).
+    - cache: `ResultCache` for finished conversions (default: one spilling to `results_dir`).
+    - denoise_strength: Filter strength for the denoise stage.
+    - results_dir: Directory for spilled results and the memory-mapped files of large scans.
+    """
+
+    def __init__(self, workers=None, max_pending=None, cache=None, denoise_strength=3, results_dir=RESULTS_DIR):
+        self.workers = workers or int(os.environ.get("ROLLSHIFT_WORKERS", 2))
+        self.max_pending = max_pending or int(os.environ.get("ROLLSHIFT_QUEUE_DEPTH", 8))
+        self.cache = ResultCache(spill_dir=results_dir) if cache is None else cache
+        self.denoise_strength = denoise_strength
+        self.results_dir = results_dir
+        self._jobs = {}  # Unfinished jobs by result key
+        self._lock = threading.Lock()
+        # Spawned workers: forking a multi-threaded server process isn't safe
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._pool = self._start_pool()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _start_pool(self):
+        # Workers load the image engine as they start, with the CPU cores split between them
+        threads = engine.CV_THREADS or max((os.cpu_count() or 1) // self.workers, 1)
+        return ProcessPoolExecutor(
+            self.workers, mp_context=self._context, initializer=_init_worker, initargs=(self._events, threads)
+        )
+
+    # Hand a job to the pool. A worker that died (e.g. killed for running out of memory
+    # on a huge scan) breaks the whole pool; it is replaced by a new one, once.
+    def _submit(self, *args):
+        for attempt in range(2):
+            pool = self._pool
+            try:
+                with _without_main_script():
+                    return pool.submit(convert_upload, *args)
+            except BrokenProcessPool:
+                with self._lock:
+                    if self._pool is pool:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        self._pool = self._start_pool()
+        raise WorkersUnavailable("the conversion workers could not be restarted")
+
+    def submit(self, upload_key, data, region=None, base=None, profile=False, stock=None):
+        """
+        Queues the upload `data` (encoded image bytes) whose hash is `upload_key`.
+        Pass the (x, y, width, height) `region` of one frame and the film `base` to
+        convert a single frame of a strip, and a profile name as `stock` to convert
+        with that film-stock profile (raises ValueError for unknown profiles).
+
+        Returns a finished job straight away when the result is cached, and the
+        existing job when the same conversion is already queued or running. With
+        profile=True the conversion runs again under the profiler even when cached
+        (and a large scan's profiled result is kept by its job only, not cached).
+        Raises QueueFull when too many jobs are waiting and WorkersUnavailable when
+        the worker pool crashed and can't be restarted.
+        """
+        params = {"denoise_strength": self.denoise_strength}
+        if region is not None:
+            params["region"] = tuple(int(value) for value in region)
+        if base is not None:
+            params["base"] = tuple(round(float(value), 3) for value in base)
+        if stock is not None:
+            params["stock"] = repr(load_profile(stock))  # Name and table digest
+        key = result_key(upload_key, **params)
+        with self._lock:
+            result = None if profile else self.cache.get(key)
+            if result is not None:
+                return Job.from_result(key, result)
+            if key in self._jobs:
+                return self._jobs[key]
+            if len(self._jobs) >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} conversions are already queued")
+            job = self._jobs[key] = Job(key, STAGES if stock is None else PROFILE_STAGES)
+        try:
+            future = self._submit(key, data, self.denoise_strength, self.results_dir, region, base, profile, stock)
+        except Exception:
+            with self._lock:
+                del self._jobs[key]
+            raise
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    # The finished job's positive encoded for download, on first request only (see ResultCache.download)
+    def download(self, job, output_format="JPEG", quality=95, encode=True):
+        return self.cache.download(job.key, job.result, output_format, quality, encode)
+
+    def _listen(self):
+        while True:
+            key, label, seconds, preview = self._events.get()
+            with self._lock:
+                job = self._jobs.get(key)
+                if job is None:
+                    continue
+                job.status = "running"
+                if seconds is not None:
+                    job.stages[label] = seconds
+                if preview is not None:
+                    job.preview = (label, preview)
+
+    def _update_gauges(self):
+        for name, value in self.cache.stats.items():
+            REGISTRY.set_value(f"rollshift_cache_{name}_total", value, f"Result cache {name.replace('_', ' ')}.", "counter")
+        REGISTRY.set_value("rollshift_cache_memory_bytes", self.cache.memory_bytes, "Result cache memory in use.")
+        REGISTRY.set_value("rollshift_jobs_pending", len(self._jobs), "Conversions queued or running.")
+
+    def _finish(self, job, future):
+        try:
+            previews, image, timings, metrics, report = future.result()
+        except Exception as error:
+            # A worker that died broke the pool; the next submit replaces it
+            if isinstance(error, BrokenProcessPool):
+                message = "the conversion worker crashed, most likely out of memory"
+            else:
+                message = f"{type(error).__name__}: {error}"
+            with self._lock:
+                del self._jobs[job.key]
+                job.error = message
+                job.status = "failed"
+                self._update_gauges()
+            REGISTRY.write()
+            return
+        # A profiled large scan stays in its own work directory and out of the cache
+        cache = not (report is not None and isinstance(image, str))
+        if isinstance(image, str):
+            image = np.load(image, mmap_mode="r")
+        result = CachedResult(image, previews, timings)
+        with self._lock:
+            if cache:
+                self.cache.put(job.key, result)
+            del self._jobs[job.key]
+            job.metrics, job.profile = metrics, report
+            job._set_result(result)
+            self._update_gauges()
+        for stage in metrics:
+            REGISTRY.record(stage, key=job.key)
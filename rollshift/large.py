@@ -0,0 +1,327 @@
+"""Large-scan mode: memory-mapped, strip-by-strip conversion for 100+ MP scans.
+
+TIFF scans (the usual format at these sizes) are decoded straight into a memory-
+mapped .npy file one band of strips or tiles at a time (see `decode_to_memmap`).
+OpenCV can't decode part of an image, so other formats (JPEG, PNG, WebP...) and
+TIFFs with separate colour planes or JPEG compression are decoded whole in memory
+first and then written out; their peak memory still holds the full decoded scan.
+The decoded scan and every stage output live in memory-mapped .npy files, the
+per-pixel stages run over horizontal strips, and the film base is gathered in a
+streaming pass first. The LAB channel means and gray mean come from a strided
+sample (rollshift.stats), or from streaming passes too with exact_stats.
+Each intermediate file is deleted as soon as the next stage has consumed it, so
+resident memory stays near one strip per stage plus the single-channel plane CLAHE
+works on. The results match the in-memory `ConversionPipeline`.
+"""
+import io
+import os
+import struct
+
+import cv2
+import numpy as np
+from PIL import TiffImagePlugin, TiffTags
+
+from rollshift.image import (
+    _base_cutoff, _base_sums, _brightness, _brightness_histogram, _clahe, _from_lab, _neutral_ab, _to_lab,
+    decode_image, denoise_tiled, make_proxy,
+)
+from rollshift.metrics import measure, megapixels
+from rollshift.stats import ImageStats
+from rollshift.tone import apply_lut, gamma_lut, invert_lut, max_value
+
+STRIP_BYTES = 64 * 1024 * 1024  # Target size of one strip of pixels
+BAND_BYTES = 8 * 1024 * 1024  # Target size of one decoded band of a TIFF; decoding takes about four times that
+TIFF_COMPRESSIONS = (1, 5, 8, 32773, 32946)  # None, LZW, Deflate, PackBits, old-style Deflate
+# Tags a band keeps from the scan's first IFD; the others describe the whole file (layout, metadata)
+BAND_TAGS = (258, 259, 262, 277, 278, 284, 317, 322, 323, 338, 339)
+
+
+# A new memory-mapped .npy file at `path`. An existing file there is unlinked first
+# rather than truncated, so arrays still mapped from it (e.g. the result of an earlier
+# run of the same scan held by another session) keep their pixels.
+def new_memmap(path, dtype, shape):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+# Write a decoded image into a memory-mapped .npy file so it can leave RAM
+def to_memmap(image, path):
+    mapped = new_memmap(path, image.dtype, image.shape)
+    mapped[:] = image
+    mapped.flush()
+    return mapped
+
+
+# The first IFD of a TIFF that `decode_to_memmap` can read band by band, or None
+def _tiff_ifd(data):
+    if data[:4] not in (b"II*\x00", b"MM\x00*"):
+        return None
+    try:
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(data[:8])
+        stream = io.BytesIO(data)
+        stream.seek(ifd.next)
+        ifd.load(stream)
+    except Exception:
+        return None  # Malformed headers get the full decode, which reports the error
+    layout = (322, 323, 324, 325) if 322 in ifd else (273, 279)
+    if not all(tag in ifd for tag in (256, 257, 258, *layout)):
+        return None
+    if ifd.get(259, 1) not in TIFF_COMPRESSIONS or ifd.get(284, 1) != 1 or ifd.get(262) not in (0, 1, 2):
+        return None
+    return ifd
+
+
+# (height, width) of a scan that `decode_to_memmap` reads band by band, or None
+def banded_shape(data):
+    ifd = _tiff_ifd(data)
+    return None if ifd is None else (ifd[257], ifd[256])
+
+
+# A TIFF of its own holding `rows` rows of the scan: the strips or tiles `chunks` of `ifd`
+def _band_tiff(ifd, data, chunks, rows):
+    tiled = 322 in ifd
+    offsets_tag, counts_tag = (324, 325) if tiled else (273, 279)
+    offsets, counts = ifd[offsets_tag], ifd[counts_tag]
+    band = TiffImagePlugin.ImageFileDirectory_v2(prefix=ifd.prefix)
+    for tag in BAND_TAGS:
+        if tag in ifd:
+            band.tagtype[tag] = ifd.tagtype[tag]
+            band[tag] = ifd[tag]
+    band[256], band[257] = ifd[256], rows
+    # The band's data follows the IFD. Pillow moves strip offsets past the IFD itself;
+    # tile offsets are placed once the IFD's size is known.
+    starts = np.cumsum([0] + [counts[i] for i in chunks])[:-1]
+    band.tagtype[offsets_tag] = band.tagtype[counts_tag] = TiffTags.LONG
+    band[offsets_tag] = tuple(int(start) for start in starts)
+    band[counts_tag] = tuple(counts[i] for i in chunks)
+    if tiled:
+        end = 8 + len(band.tobytes(8))
+        band[offsets_tag] = tuple(int(end + start) for start in starts)
+    endian = "<" if ifd.prefix == b"II" else ">"
+    header = ifd.prefix + struct.pack(endian + "HL", 42, 8)
+    data = memoryview(data)
+    return b"".join([header, band.tobytes(8), *(data[offsets[i]:offsets[i] + counts[i]] for i in chunks)])
+
+
+def decode_to_memmap(data, path, band_bytes=BAND_BYTES):
+    """
+    Decodes an encoded scan into a memory-mapped .npy file without holding it in RAM.
+
+    A TIFF is read a band of strips (or rows of tiles) at a time: each band is copied
+    into a small TIFF of its own and decoded by OpenCV, so the pixels are the ones
+    `decode_image` gives while only one band is in memory. Other formats, and TIFFs
+    with separate colour planes or compressions not in TIFF_COMPRESSIONS, are decoded
+    whole first (see the module docstring).
+
+    Parameters:
+    - data: The encoded scan.
+    - path: Path of the .npy file to write.
+    - band_bytes: Target size of one decoded band (default: BAND_BYTES).
+
+    Returns:
+    - The decoded BGR image, memory-mapped from `path`.
+    """
+    ifd = _tiff_ifd(data)
+    if ifd is None:
+        return to_memmap(decode_image(data), path)
+    width, height = ifd[256], ifd[257]
+    if 322 in ifd:
+        band_rows, across = ifd[323], -(-width // ifd[322])
+    else:
+        band_rows, across = min(ifd.get(278, height), height), 1
+    bands = -(-height // band_rows)
+    per_group = max(band_bytes // (band_rows * width * max(sum(ifd[258]) // 8, 1)), 1)
+    mapped = None
+    for first in range(0, bands, per_group):
+        last = min(first + per_group, bands)
+        top, bottom = first * band_rows, min(last * band_rows, height)
+        band_tiff = _band_tiff(ifd, data, range(first * across, last * across), bottom - top)
+        band = decode_image(band_tiff)
+        if mapped is None:
+            mapped = new_memmap(path, band.dtype, (height, width, 3))
+        mapped[top:bottom] = band
+    mapped.flush()
+    return mapped
+
+
+def _strips(image, strip_rows):
+    for top in range(0, image.shape[0], strip_rows):
+        yield slice(top, min(top + strip_rows, image.shape[0]))
+
+
+def _remove(mapped):
+    path = mapped.filename
+    del mapped
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class LargeImagePipeline:
+    """
+    Runs the conversion stages on a memory-mapped scan, strip by strip.
+
+    Parameters:
+    - workdir: Directory for the memory-mapped intermediates (e.g. temp/<upload hash>).
+    - cache: Optional dict keeping finished runs by upload key across Streamlit reruns.
+    - denoise_strength: Filter strength for the denoise stage.
+    - strip_rows: Rows per strip (default: about 64 MB worth of pixels).
+    - on_stage: Optional callback `on_stage(label, image, seconds)` run as each stage finishes.
+    - exact_stats: Measure global statistics in streaming passes over every pixel
+      instead of on a strided sample (see rollshift.stats).
+    - film_profile: Optional `FilmProfile` (rollshift.profiles) whose 3D LUT replaces
+      the inversion, colour balance and gamma stages.
+    """
+
+    STAGES = ("Base Detection", "Inverted Image", "Color Balanced Image", "Gamma Corrected Image", "Denoised Image")
+    PROFILE_STAGES = ("Base Detection", "Film Profile", "Denoised Image")
+
+    def __init__(self, workdir, cache=None, denoise_strength=3, strip_rows=None, on_stage=None, exact_stats=False,
+                 film_profile=None):
+        self.workdir = workdir
+        self.cache = {} if cache is None else cache
+        self.denoise_strength = denoise_strength
+        self.strip_rows = strip_rows
+        self.on_stage = on_stage
+        self.exact_stats = exact_stats
+        self.film_profile = film_profile
+        self.timings = {}
+        self.metrics = []  # StageMetrics of the stages run by the last `run`
+        os.makedirs(workdir, exist_ok=True)
+
+    def _new(self, name, like, channels=3, dtype=None):
+        shape = like.shape[:2] + ((channels,) if channels > 1 else ())
+        return new_memmap(os.path.join(self.workdir, f"{name}.npy"), dtype or like.dtype, shape)
+
+    def _timed(self, label, func, *args):
+        with measure(func.__name__, megapixels(args[0])) as metrics:
+            result = func(*args)
+        self.timings[label] = metrics.wall
+        self.metrics.append(metrics)
+        if self.on_stage:
+            self.on_stage(label, result, self.timings[label])
+        return result
+
+    # Streaming find_base: one pass for the brightness histogram, one for the sums
+    def find_base(self, neg, percentile=99.0):
+        hist = np.zeros(766)
+        for rows in _strips(neg, self.strip_rows):
+            hist += _brightness_histogram(_brightness(neg[rows]))
+        count = max(int((100 - percentile) / 100 * neg.shape[0] * neg.shape[1]), 1)
+        threshold, n_brighter = _base_cutoff(hist, count)
+
+        above_sum, tied_sum, n_tied = np.zeros(3), np.zeros(3), 0
+        for rows in _strips(neg, self.strip_rows):
+            brightness = _brightness(neg[rows])
+            strip_above, strip_tied_mean = _base_sums(neg[rows], brightness, threshold)
+            strip_tied = cv2.countNonZero((brightness == threshold).view(np.uint8))
+            above_sum += strip_above
+            tied_sum += strip_tied_mean * strip_tied
+            n_tied += strip_tied
+        return (above_sum + tied_sum / max(n_tied, 1) * (count - n_brighter)) / count
+
+    def invert(self, neg, base):
+        lut = invert_lut(base, neg.dtype)
+        inverted = self._new("inverted", neg)
+        for rows in _strips(neg, self.strip_rows):
+            inverted[rows] = apply_lut(np.ascontiguousarray(neg[rows]), lut)
+        return inverted
+
+    # Fused LAB white balance and CLAHE, as auto_color_balance, in two streaming passes
+    def auto_color_balance(self, image):
+        # Pass 1: the 8-bit L plane CLAHE needs (and the a/b sums for exact statistics)
+        l_plane = self._new("lightness", image, channels=1, dtype=np.uint8)
+        ab_sum = np.zeros(2)
+        for rows in _strips(image, self.strip_rows):
+            l, a, b = cv2.split(_to_lab(np.ascontiguousarray(image[rows])))
+            if self.exact_stats:
+                ab_sum += cv2.sumElems(a)[0], cv2.sumElems(b)[0]
+            l_plane[rows] = cv2.convertScaleAbs(l, alpha=2.55) if l.dtype == np.float32 else l
+        if self.exact_stats:
+            a_mean, b_mean = (ab_sum / (image.shape[0] * image.shape[1])).tolist()
+        else:
+            a_mean, b_mean = ImageStats(image).lab_ab_means
+
+        # CLAHE works on tiles of the whole frame, so it runs once on the L plane
+        equalized = _clahe().apply(np.asarray(l_plane))
+
+        # Pass 2: shift a/b to neutral, put the equalised L back and convert (in place)
+        for rows in _strips(image, self.strip_rows):
+            l, a, b = cv2.split(_to_lab(np.ascontiguousarray(image[rows])))
+            a, b = _neutral_ab(a, b, (a_mean, b_mean))
+            if l.dtype == np.float32:
+                shift = equalized[rows].astype(np.float32) - l_plane[rows]
+                l = np.clip(l + shift * (1 / 2.55), 0, 100)
+            else:
+                l = equalized[rows]
+            image[rows] = _from_lab(cv2.merge([l, a, b]))
+        _remove(l_plane)
+        return image
+
+    def apply_profile(self, neg, base):
+        converted = self._new("converted", neg)
+        for rows in _strips(neg, self.strip_rows):
+            converted[rows] = self.film_profile.apply(neg[rows], base)
+        return converted
+
+    def auto_gamma_correction(self, image):
+        if self.exact_stats:
+            gray_sum = 0.0
+            for rows in _strips(image, self.strip_rows):
+                gray_sum += cv2.sumElems(cv2.cvtColor(np.ascontiguousarray(image[rows]), cv2.COLOR_BGR2GRAY))[0]
+            gray_mean = gray_sum / (image.shape[0] * image.shape[1])
+        else:
+            gray_mean = ImageStats(image).gray_mean
+        mean_intensity = gray_mean * 255 / max_value(image)
+        gamma = np.clip(1.5 - (mean_intensity / 128), 0.4, 2.5)
+        lut = gamma_lut(gamma, image.dtype)
+        for rows in _strips(image, self.strip_rows):
+            image[rows] = apply_lut(np.ascontiguousarray(image[rows]), lut)
+        return image
+
+    def denoise(self, image, out):
+        return denoise_tiled(image, self.denoise_strength, out=out)
+
+    def run(self, rawscan, upload_key=None, base=None):
+        """
+        Converts a memory-mapped scan (see `to_memmap`), with the film base `base`
+        when given instead of detecting it.
+
+        Returns the stages as (label, image) like `ConversionPipeline.run`, where the
+        intermediate stages are downscaled previews (their files are already gone)
+        and the last entry is the full-resolution memory-mapped result.
+        """
+        key = (upload_key, self.denoise_strength, None if base is None else tuple(base), repr(self.film_profile))
+        if upload_key is not None and key in self.cache:
+            self.timings = dict.fromkeys(self.STAGES if self.film_profile is None else self.PROFILE_STAGES, 0.0)
+            return self.cache[key]
+        if self.strip_rows is None:
+            row_bytes = rawscan.shape[1] * rawscan.shape[2] * rawscan.itemsize
+            self.strip_rows = max(STRIP_BYTES // row_bytes, 64)
+        self.timings = {}
+        self.metrics = []
+        steps = [("Raw Scan", make_proxy(rawscan))]
+
+        if base is None:
+            base = self._timed("Base Detection", self.find_base, rawscan)
+        if self.film_profile is not None:
+            image = self._timed("Film Profile", self.apply_profile, rawscan, base)
+            steps.append(("Film Profile", make_proxy(image)))
+        else:
+            image = self._timed("Inverted Image", self.invert, rawscan, base)
+            steps.append(("Inverted Image", make_proxy(image)))
+            # Colour balance and gamma rewrite the inverted file in place
+            image = self._timed("Color Balanced Image", self.auto_color_balance, image)
+            steps.append(("Color Balanced Image", make_proxy(image)))
+            image = self._timed("Gamma Corrected Image", self.auto_gamma_correction, image)
+            steps.append(("Gamma Corrected Image", make_proxy(image)))
+
+        denoised = self._new("denoised", image)
+        self._timed("Denoised Image", self.denoise, image, denoised)
+        denoised.flush()
+        _remove(image)
+        steps.append(("Denoised Image", denoised))
+        if upload_key is not None:
+            self.cache[key] = steps
+        return steps
@@ -0,0 +1,168 @@
+"""3D lookup tables: trilinear application and .cube files.
+
+A 3D LUT maps every colour to another through an N x N x N grid of output colours
+(N is 33 or 65 for film profiles), interpolated trilinearly between the eight grid
+points around each input colour. It captures cross-channel colour behaviour that
+per-channel curves (rollshift.tone) can't, and applies any chain of global colour
+operations in a single pass over the image.
+
+Tables are float32 arrays of shape (N, N, N, 3) indexed [b, g, r] like the BGR
+images they are applied to, holding B, G, R outputs in 0..1. `read_cube` and
+`write_cube` convert from and to the Adobe/Resolve .cube format (R varying fastest,
+RGB outputs), so LUTs made with other tools can be used and ours exported.
+"""
+import cv2
+import numpy as np
+
+from rollshift.tone import max_value
+
+CHUNK_PIXELS = 1 << 18  # Pixels looked up at a time, bounding the float32 buffers
+MAX_REMAP_COLUMNS = 32767  # cv2.remap addresses coordinates as 16-bit integers
+
+
+def identity_lut(size=33):
+    levels = np.linspace(0, 1, size, dtype=np.float32)
+    b, g, r = np.meshgrid(levels, levels, levels, indexing="ij")
+    return np.stack([b, g, r], axis=-1)
+
+
+def _interpolate(pixels, table, size, factors):
+    # pixels: (P, 3) values; factors map them to grid coordinates 0..size-1 per channel
+    coords = np.clip(pixels.astype(np.float32) * factors, 0, size - 1)
+    lower = np.minimum(coords.astype(np.int32), size - 2)
+    fraction = coords - lower
+    index = (lower[:, 0] * size + lower[:, 1]) * size + lower[:, 2]
+    fb, fg, fr = fraction[:, 0:1], fraction[:, 1:2], fraction[:, 2:3]
+    # Interpolate along R, then G, then B
+    plane = size * size
+    corners = {}
+    for offset in (0, size, plane, plane + size):
+        low = table[index + offset]
+        corners[offset] = low + (table[index + offset + 1] - low) * fr
+    near = corners[0] + (corners[size] - corners[0]) * fg
+    far = corners[plane] + (corners[plane + size] - corners[plane]) * fg
+    return near + (far - near) * fb
+
+
+def _atlas(lut, levels, b_factor):
+    # The table resampled along B at `levels` input levels (input level k sits at grid
+    # coordinate k * b_factor) and laid out as a 2D image: row g, column k * N + r.
+    # Each B slice is then an N x N tile that cv2.remap interpolates bilinearly in R and G.
+    size = lut.shape[0]
+    b = np.minimum(np.arange(levels, dtype=np.float32) * b_factor, size - 1)
+    lower = np.minimum(b.astype(np.int32), size - 2)
+    fraction = (b - lower)[:, None, None, None]
+    slices = lut[lower] + (lut[lower + 1] - lut[lower]) * fraction
+    return np.ascontiguousarray(slices.transpose(1, 0, 2, 3).reshape(size, levels * size, 3), dtype=np.float32)
+
+
+def apply_lut3d(image, lut, scale=None, chunk_pixels=CHUNK_PIXELS):
+    """
+    Maps every pixel of a BGR image through a 3D LUT with trilinear interpolation.
+
+    The table is expanded along B to one slice per input level (8-bit) or to as many
+    slices as cv2.remap can address (16-bit, about 1000 for a 33-point table), so a
+    single bilinear remap over the slices does the whole lookup; for 8-bit images
+    this is exact trilinear interpolation.
+
+    Parameters:
+    - image: 8- or 16-bit BGR image (memory-mapped arrays work too).
+    - lut: (N, N, N, 3) table, see the module docstring.
+    - scale: Optional (B, G, R) factors applied to the normalised input before the
+      lookup (clipped to 1), e.g. 1 / film base; it costs nothing extra.
+    - chunk_pixels: Pixels converted at a time, bounding the float32 buffers.
+
+    Returns:
+    - A new image of the same depth.
+    """
+    size = lut.shape[0]
+    top = max_value(image)
+    scale = np.ones(3, dtype=np.float32) if scale is None else np.asarray(scale, dtype=np.float32)
+    levels = 256 if image.dtype == np.uint8 else MAX_REMAP_COLUMNS // size
+    atlas = _atlas(np.asarray(lut, dtype=np.float32), levels, (size - 1) * scale[0] / (levels - 1))
+    # Per pixel: (B slice column, G coordinate, R coordinate), then the remap map (column + R, G)
+    factors = np.array([(levels - 1) / top, *((size - 1) / top * scale[1:])], dtype=np.float32)
+    limits = np.array([levels - 1, size - 1, size - 1], dtype=np.float32)
+    if image.dtype == np.uint8:
+        table = np.minimum(np.arange(256, dtype=np.float32)[:, None] * factors, limits)
+        table[:, 0] *= size
+        table = table.reshape(256, 1, 3)
+
+    height, width = image.shape[:2]
+    result = np.empty((height, width, 3), dtype=image.dtype)
+    rows = max(chunk_pixels // width, 1)
+    for start in range(0, height, rows):
+        pixels = np.ascontiguousarray(image[start:start + rows])
+        if image.dtype == np.uint8:
+            coords = cv2.LUT(pixels, table)
+        else:
+            coords = np.minimum(pixels.astype(np.float32) * factors, limits)
+            coords[..., 0] = np.rint(coords[..., 0]) * size
+        remap = np.empty(coords.shape[:2] + (2,), dtype=np.float32)
+        np.add(coords[..., 0], coords[..., 2], out=remap[..., 0])
+        remap[..., 1] = coords[..., 1]
+        values = cv2.remap(atlas, remap, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        if image.dtype == np.uint8:
+            result[start:start + rows] = cv2.convertScaleAbs(values, alpha=top)
+        else:
+            result[start:start + rows] = (values * top + 0.5).astype(image.dtype)
+    return result
+
+
+# Resample a table to another grid size (e.g. to import a 17-point LUT as a 33-point profile)
+def resize_lut(lut, size):
+    if lut.shape[0] == size:
+        return lut
+    grid = identity_lut(size).reshape(-1, 3)
+    return _interpolate(grid, lut.reshape(-1, 3), lut.shape[0], lut.shape[0] - 1).reshape(size, size, size, 3)
+
+
+def read_cube(path):
+    """
+    Reads a 3D LUT from a .cube file.
+
+    Returns:
+    - (lut, title) with `lut` as described in the module docstring; a DOMAIN_MIN /
+      DOMAIN_MAX other than 0..1 is folded into the table.
+    """
+    title, size = "", None
+    domain_min, domain_max = np.zeros(3), np.ones(3)
+    values = []
+    with open(path) as cube_file:
+        for line in cube_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keyword, _, rest = line.partition(" ")
+            if keyword == "TITLE":
+                title = rest.strip().strip('"')
+            elif keyword == "LUT_3D_SIZE":
+                size = int(rest)
+            elif keyword == "DOMAIN_MIN":
+                domain_min = np.array(rest.split(), dtype=np.float64)
+            elif keyword == "DOMAIN_MAX":
+                domain_max = np.array(rest.split(), dtype=np.float64)
+            elif keyword == "LUT_1D_SIZE":
+                raise ValueError(f"{path}: 1D LUTs are not supported")
+            elif keyword[0].isdigit() or keyword[0] in "-.":
+                values.append(line.split())
+    if size is None or len(values) != size ** 3:
+        raise ValueError(f"{path}: expected LUT_3D_SIZE and size^3 entries, found {len(values)}")
+    lut = np.array(values, dtype=np.float32).reshape(size, size, size, 3)[..., ::-1]  # RGB -> BGR outputs
+    if (domain_min != 0).any() or (domain_max != 1).any():
+        # Grid point i of channel c sits at domain_min + i / (size - 1) * (domain_max - domain_min);
+        # resample onto the 0..1 grid (inputs outside the domain clamp to its edge)
+        span = (domain_max - domain_min)[::-1]  # BGR
+        grid = (identity_lut(size).reshape(-1, 3) - domain_min[::-1]) / span
+        lut = _interpolate(grid, lut.reshape(-1, 3), size, size - 1).reshape(size, size, size, 3)
+    return np.ascontiguousarray(lut), title
+
+
+def write_cube(lut, path, title=""):
+    size = lut.shape[0]
+    with open(path, "w") as cube_file:
+        if title:
+            cube_file.write(f'TITLE "{title}"\n')
+        cube_file.write(f"LUT_3D_SIZE {size}\nDOMAIN_MIN 0.0 0.0 0.0\nDOMAIN_MAX 1.0 1.0 1.0\n")
+        rgb = np.clip(lut[..., ::-1].reshape(-1, 3), 0, 1)
+        np.savetxt(cube_file, rgb, fmt="%.5f")
@@ -0,0 +1,206 @@
+"""Per-stage metrics and opt-in profiling for the conversion pipeline.
+
+Every pipeline stage and download encoding is run under `measure`, which records
+its wall time, the process's CPU time (all threads), the peak memory it needed on
+top of the memory in use when it started, and the image size in megapixels. The
+metrics of a conversion travel with its job for the page's debug panel, and
+`MetricsRegistry.record` logs each one as a JSON line on the "rollshift.metrics"
+logger and aggregates it per stage. The registry renders the aggregates in the
+Prometheus text format and, when a file is configured, rewrites that file after
+every update so a local scraper (e.g. node_exporter's textfile collector) can
+read it.
+
+Peak memory is read from the kernel's resident-set high-water mark, which Linux
+lets a process reset before each stage; elsewhere it is the growth of the
+process-lifetime peak. Stages running at the same time in one process share the
+measurement.
+
+`profile_run` captures a cProfile profile and tracemalloc statistics of a single
+call; it is opt-in because tracing slows the run down.
+
+Settings (environment variables):
+- ROLLSHIFT_METRICS_FILE: Prometheus text file to keep up to date (default: none).
+"""
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger("rollshift.metrics")
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its peak RSS; elsewhere peaks are process-lifetime maxima
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def megapixels(image):
+    return image.shape[0] * image.shape[1] / 1e6 if getattr(image, "ndim", 0) >= 2 else 0.0
+
+
+class StageMetrics:
+    """
+    Measurements of one stage run.
+
+    Attributes:
+    - stage: Name of the stage's function, e.g. "find_base".
+    - megapixels: Size of the stage's input image.
+    - wall, cpu: Seconds of wall-clock and process CPU time.
+    - peak_bytes: Peak memory above what was in use when the stage started.
+    """
+
+    def __init__(self, stage, megapixels=0.0, wall=0.0, cpu=0.0, peak_bytes=0):
+        self.stage = stage
+        self.megapixels = megapixels
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_bytes = peak_bytes
+
+    def as_dict(self):
+        return {
+            "stage": self.stage, "megapixels": round(self.megapixels, 3), "wall_s": round(self.wall, 4),
+            "cpu_s": round(self.cpu, 4), "peak_bytes": self.peak_bytes,
+        }
+
+
+# Measure the block as stage `stage` on an image of `megapixels` MP; fills in the
+# yielded StageMetrics when the block exits
+@contextmanager
+def measure(stage, megapixels=0.0):
+    metrics = StageMetrics(stage, megapixels)
+    reset_peak_rss()
+    rss_before = peak_rss_bytes()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield metrics
+    finally:
+        metrics.wall = time.perf_counter() - start
+        metrics.cpu = time.process_time() - cpu_start
+        metrics.peak_bytes = max(peak_rss_bytes() - rss_before, 0)
+
+
+class MetricsRegistry:
+    """
+    Per-stage aggregates of recorded `StageMetrics`, plus gauges set by their owners.
+
+    Parameters:
+    - path: Prometheus text file rewritten after every update (default: ROLLSHIFT_METRICS_FILE, or none).
+    """
+
+    STAGE_SERIES = (
+        ("runs_total", "counter", "Stage runs."),
+        ("wall_seconds_total", "counter", "Wall-clock seconds spent in the stage."),
+        ("cpu_seconds_total", "counter", "Process CPU seconds spent in the stage."),
+        ("megapixels_total", "counter", "Megapixels processed by the stage."),
+        ("peak_bytes", "gauge", "Largest peak memory of a single stage run."),
+    )
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("ROLLSHIFT_METRICS_FILE")
+        self._stages = {}
+        self._values = {}  # name -> (kind, help, value)
+        self._lock = threading.Lock()
+
+    def record(self, metrics, **labels):
+        logger.info(json.dumps({"event": "stage", **metrics.as_dict(), **labels}))
+        with self._lock:
+            stage = self._stages.setdefault(metrics.stage, dict.fromkeys([name for name, _, _ in self.STAGE_SERIES], 0))
+            stage["runs_total"] += 1
+            stage["wall_seconds_total"] += metrics.wall
+            stage["cpu_seconds_total"] += metrics.cpu
+            stage["megapixels_total"] += metrics.megapixels
+            stage["peak_bytes"] = max(stage["peak_bytes"], metrics.peak_bytes)
+        self.write()
+
+    def set_value(self, name, value, help_text="", kind="gauge"):
+        with self._lock:
+            self._values[name] = (kind, help_text, value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for series, kind, help_text in self.STAGE_SERIES:
+                name = f"rollshift_stage_{series}"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                lines += [f'{name}{{stage="{stage}"}} {values[series]:g}' for stage, values in sorted(self._stages.items())]
+            for name, (kind, help_text, value) in sorted(self._values.items()):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        if not self.path:
+            return
+        # Written next to the target and renamed over it, so a scraper never reads half a file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_path, self.path)
+
+
+REGISTRY = MetricsRegistry()  # The server process's registry
+
+
+# Send the structured metric lines to stderr, unless the application configured logging itself
+def enable_log():
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def profile_run(func, *args, top=25, **kwargs):
+    """
+    Runs `func(*args, **kwargs)` under cProfile and tracemalloc.
+
+    Returns:
+    - (result, report), where report holds "stats" (the profile in the .prof format
+      read by pstats and snakeviz), "text" (the `top` functions by cumulative time),
+      "allocations" (the `top` allocation sites still alive at the end) and
+      "peak_bytes" (peak memory traced during the run).
+    """
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+    profiler.create_stats()
+    allocations = "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
+    return result, {
+        "stats": marshal.dumps(profiler.stats), "text": text.getvalue(), "allocations": allocations, "peak_bytes": peak,
+    }
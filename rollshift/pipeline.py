@@ -0,0 +1,79 @@
+"""Staged, memoized conversion pipeline built on the functions in rollshift.image."""
+import hashlib
+
+from rollshift.image import auto_color_balance, auto_gamma_correction, denoise_tiled, find_base, invert
+from rollshift.metrics import measure, megapixels
+from rollshift.profiles import apply_profile
+from rollshift.stats import ImageStats
+
+
+# Conversion pipeline: every stage runs once and hands its output to the next one.
+# Results are memoized by a key chained from the upload hash and each stage's
+# parameters, so Streamlit reruns of the same upload skip straight to display.
+# `on_stage(label, image, seconds)` is called as each stage finishes, for progress reporting.
+# Global statistics are measured on a sample of each image unless `exact_stats` is set.
+# Stages that run (rather than come from the cache) are measured into `metrics` (see rollshift.metrics).
+# With a `film_profile` (rollshift.profiles) its 3D LUT replaces the inversion, colour
+# balance and gamma stages with a single "Film Profile" pass.
+class ConversionPipeline:
+    def __init__(self, cache=None, denoise_strength=3, denoiser=denoise_tiled, on_stage=None, exact_stats=False,
+                 film_profile=None):
+        self.cache = {} if cache is None else cache
+        self.denoise_strength = denoise_strength
+        self.denoiser = denoiser  # `denoise` or `denoise_tiled`, which share a signature
+        self.on_stage = on_stage
+        self.exact_stats = exact_stats
+        self.film_profile = film_profile
+        self.timings = {}  # stage label -> seconds spent (0.0 when served from cache)
+        self.metrics = []  # StageMetrics of the stages that ran
+
+    @staticmethod
+    def _stage_key(key, label, name, params):
+        return hashlib.sha1(repr((key, label, name, sorted(params.items()))).encode()).hexdigest()
+
+    def _run_stage(self, key, label, func, *args, **params):
+        key = self._stage_key(key, label, func.__name__, params)
+        if key in self.cache:
+            self.timings[label] = 0.0
+            result = self.cache[key]
+        else:
+            with measure(func.__name__, megapixels(args[0])) as metrics:
+                result = func(*args, **params)
+            self.timings[label] = metrics.wall
+            self.metrics.append(metrics)
+            self.cache[key] = result
+        if self.on_stage:
+            self.on_stage(label, result, self.timings[label])
+        return key, result
+
+    # Pass `base` to reuse a film base shared by the whole roll instead of detecting it
+    def run(self, rawscan, upload_key, base=None):
+        self.timings = {}
+        self.metrics = []
+        if base is None:
+            key, base = self._run_stage(upload_key, "Base Detection", find_base, rawscan)
+        else:
+            key = self._stage_key(upload_key, "Base Detection", "shared", {"base": tuple(base)})
+        if self.film_profile is not None:
+            key, converted = self._run_stage(key, "Film Profile", apply_profile, rawscan, base, profile=self.film_profile)
+            key, denoised = self._run_stage(key, "Denoised Image", self.denoiser, converted, strength=self.denoise_strength)
+            return [("Raw Scan", rawscan), ("Film Profile", converted), ("Denoised Image", denoised)]
+        key, inverted = self._run_stage(key, "Inverted Image", invert, rawscan, base)
+        key, balanced = self._run_stage(
+            key, "Color Balanced Image", auto_color_balance, inverted, stats=ImageStats(inverted, self.exact_stats)
+        )
+        key, gamma = self._run_stage(
+            key, "Gamma Corrected Image", auto_gamma_correction, balanced, stats=ImageStats(balanced, self.exact_stats)
+        )
+        key, denoised = self._run_stage(key, "Denoised Image", self.denoiser, gamma, strength=self.denoise_strength)
+        return [
+            ("Raw Scan", rawscan),
+            ("Inverted Image", inverted),
+            ("Color Balanced Image", balanced),
+            ("Gamma Corrected Image", gamma),
+            ("Denoised Image", denoised),
+        ]
+
+
+def hash_upload(uploaded_file):
+    return hashlib.sha1(uploaded_file.getvalue()).hexdigest()
@@ -0,0 +1,209 @@
+"""Film-stock profiles: a stock's whole conversion baked into one 3D LUT.
+
+A profile maps the scan, divided by its film base, straight to the positive: base
+removal, inversion, colour balance and tone curve in one trilinear lookup
+(rollshift.lut3d) instead of a chain of full-resolution passes. The base is still
+measured per scan (or shared by the roll) and folded into the lookup coordinates,
+so one profile fits every exposure of the stock.
+
+Profiles are .cube files in the profiles directory next to this module, named
+after the stock (e.g. phoenix-200.cube), read once per process; they are listed by
+rollshift.assets, so a page can offer them without loading the image engine. They are fitted
+from a negative/positive sample pair of the stock, or imported from any tool that
+writes .cube files:
+
+    python -m rollshift.profiles fit NEGATIVE POSITIVE --name phoenix-200 [--size 33|65]
+    python -m rollshift.profiles import FILE.cube --name NAME
+    python -m rollshift.profiles export NAME -o FILE.cube [--size 17]
+    python -m rollshift.profiles list
+"""
+import argparse
+import hashlib
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from rollshift.assets import PROFILES_DIR, list_profiles, profile_path
+from rollshift.image import find_base, load_image
+from rollshift.lut3d import apply_lut3d, read_cube, resize_lut, write_cube
+from rollshift.tone import max_value
+
+FIT_PIXELS = 1_000_000  # Sample pairs are downscaled to about this many pixels for fitting
+FIT_ITERATIONS = 300  # Smoothing iterations of the fit
+
+
+class FilmProfile:
+    """
+    A film stock's conversion as a 3D LUT.
+
+    Parameters:
+    - name: Stock name, e.g. "phoenix-200".
+    - lut: (N, N, N, 3) table from base-normalised negative to positive (see rollshift.lut3d).
+    - title: Free-form description, kept in the .cube TITLE line.
+    """
+
+    def __init__(self, name, lut, title=""):
+        self.name = name
+        self.lut = np.ascontiguousarray(lut, dtype=np.float32)
+        self.lut.flags.writeable = False
+        self.title = title
+        self.digest = hashlib.sha1(self.lut.tobytes()).hexdigest()[:12]
+
+    # Pipeline stage keys use repr(): an edited .cube file must not hit old results
+    def __repr__(self):
+        return f"FilmProfile({self.name!r}, {self.digest})"
+
+    @property
+    def size(self):
+        return self.lut.shape[0]
+
+    def apply(self, negative, base):
+        return apply_lut3d(negative, self.lut, scale=max_value(negative) / np.asarray(base, dtype=np.float64))
+
+    @classmethod
+    def from_cube(cls, path, name=None):
+        lut, title = read_cube(path)
+        return cls(name or os.path.splitext(os.path.basename(path))[0], lut, title)
+
+    def save(self, path, size=None):
+        write_cube(resize_lut(self.lut, size or self.size), path, self.title)
+
+
+# Pipeline stage: the profile's conversion of a negative with film base `base`
+def apply_profile(negative, base, profile):
+    return profile.apply(negative, base)
+
+
+@lru_cache(maxsize=None)
+def load_profile(name):
+    if name not in list_profiles():
+        raise ValueError(f"No film profile {name!r} (installed: {', '.join(list_profiles()) or 'none'})")
+    return FilmProfile.from_cube(profile_path(name), name)
+
+
+def _downscale(image, pixels):
+    factor = (pixels / (image.shape[0] * image.shape[1])) ** 0.5
+    if factor >= 1:
+        return image
+    size = (max(int(image.shape[1] * factor), 1), max(int(image.shape[0] * factor), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _channel_curves(x, y, size):
+    # Per-channel tone curves (mean output per input bin) on the grid, the fit's fallback
+    # where the sample has no colours nearby
+    levels = np.linspace(0, 1, size)
+    curves = np.empty((size, 3), dtype=np.float64)
+    for channel in range(3):
+        bins = np.minimum((x[:, channel] * (size - 1) + 0.5).astype(np.int64), size - 1)
+        counts = np.bincount(bins, minlength=size)
+        means = np.bincount(bins, weights=y[:, channel], minlength=size) / np.maximum(counts, 1)
+        filled = counts > 0
+        curves[:, channel] = np.interp(levels, levels[filled], means[filled])
+    return curves
+
+
+def fit_lut(negative, positive, size=33, base=None, smoothness=0.3, iterations=FIT_ITERATIONS):
+    """
+    Fits a profile LUT to a negative scan and the positive it should convert to.
+
+    Every sample pixel is spread over the eight grid points around its colour with
+    trilinear weights, and the table is solved for the best fit to those samples
+    while staying smooth between grid neighbours (Jacobi iterations of a Laplacian
+    smoothing term); grid points far from any sample colour follow per-channel tone
+    curves measured on the pair.
+
+    Parameters:
+    - negative, positive: Aligned BGR images of the same frame (any size; both are
+      downscaled to about FIT_PIXELS pixels).
+    - size: Grid points per axis (33 or 65).
+    - base: Film base of the negative (default: detected with `find_base`).
+    - smoothness: Weight of the smoothing term relative to an average grid point's samples.
+    - iterations: Smoothing iterations.
+
+    Returns:
+    - The (size, size, size, 3) table.
+    """
+    if negative.shape[:2] != positive.shape[:2]:
+        positive = cv2.resize(positive, negative.shape[1::-1], interpolation=cv2.INTER_AREA)
+    if base is None:
+        base = find_base(negative)
+    x = np.clip(_downscale(negative, FIT_PIXELS).reshape(-1, 3) / np.asarray(base, dtype=np.float64), 0, 1)
+    y = _downscale(positive, FIT_PIXELS).reshape(-1, 3) / max_value(positive)
+
+    # Trilinear splatting of the samples onto the grid
+    coords = x * (size - 1)
+    lower = np.minimum(coords.astype(np.int64), size - 2)
+    fraction = coords - lower
+    weights = np.zeros(size ** 3)
+    sums = np.zeros((size ** 3, 3))
+    for corner in np.ndindex(2, 2, 2):
+        corner_weight = np.prod(np.where(corner, fraction, 1 - fraction), axis=1)
+        index = np.ravel_multi_index((lower + corner).T, (size,) * 3)
+        weights += np.bincount(index, weights=corner_weight, minlength=size ** 3)
+        for channel in range(3):
+            sums[:, channel] += np.bincount(index, weights=corner_weight * y[:, channel], minlength=size ** 3)
+    weights = weights.reshape((size,) * 3 + (1,))
+    sums = sums.reshape((size,) * 3 + (3,))
+
+    curves = _channel_curves(x, y, size)
+    prior = np.stack(np.meshgrid(curves[:, 0], curves[:, 1], curves[:, 2], indexing="ij"), axis=-1)
+    # The prior only holds where nothing else does
+    prior_weight = 1e-3 * smoothness
+
+    mu = smoothness * weights.sum() / max(np.count_nonzero(weights), 1)
+    lut = np.where(weights > 0, sums / np.maximum(weights, 1e-12), prior)
+    for _ in range(iterations):
+        padded = np.pad(lut, ((1, 1), (1, 1), (1, 1), (0, 0)), mode="edge")
+        neighbours = (
+            padded[:-2, 1:-1, 1:-1] + padded[2:, 1:-1, 1:-1] + padded[1:-1, :-2, 1:-1]
+            + padded[1:-1, 2:, 1:-1] + padded[1:-1, 1:-1, :-2] + padded[1:-1, 1:-1, 2:]
+        )
+        lut = (sums + mu * neighbours + mu * prior_weight * prior) / (weights + 6 * mu + mu * prior_weight)
+    return np.clip(lut, 0, 1).astype(np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit, import and export film-stock profiles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit = commands.add_parser("fit", help="Fit a profile from a negative/positive sample pair")
+    fit.add_argument("negative", help="Negative scan of the sample frame")
+    fit.add_argument("positive", help="Reference positive of the same frame, aligned with the scan")
+    fit.add_argument("--name", required=True, help="Profile name, e.g. phoenix-200")
+    fit.add_argument("--size", type=int, default=33, help="Grid points per axis (default: 33)")
+    fit.add_argument("--smoothness", type=float, default=0.3, help="Smoothing weight (default: 0.3)")
+    cube_import = commands.add_parser("import", help="Install a .cube LUT as a profile")
+    cube_import.add_argument("cube", help=".cube file mapping base-normalised negatives to positives")
+    cube_import.add_argument("--name", help="Profile name (default: the file name)")
+    export = commands.add_parser("export", help="Write a profile as a .cube file")
+    export.add_argument("name", help="Profile name")
+    export.add_argument("-o", "--output", required=True, help=".cube file to write")
+    export.add_argument("--size", type=int, help="Grid points per axis (default: the profile's)")
+    commands.add_parser("list", help="List the installed profiles")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name in list_profiles():
+            print(f"{name}: {load_profile(name).title}")
+        return 0
+    if args.command == "export":
+        load_profile(args.name).save(args.output, args.size)
+        print(f"Wrote {args.output}")
+        return 0
+
+    if args.command == "fit":
+        lut = fit_lut(load_image(args.negative), load_image(args.positive), args.size, smoothness=args.smoothness)
+        profile = FilmProfile(args.name, lut, f"RollShift {args.name}, fitted from {os.path.basename(args.negative)}")
+    else:
+        profile = FilmProfile.from_cube(args.cube, args.name)
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    profile.save(profile_path(profile.name))
+    load_profile.cache_clear()
+    print(f"Wrote {profile_path(profile.name)} ({profile.size}^3)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+"""Roll proofs: the per-pixel conversion stages over a stack of same-size frames.
+
+Proofs (thumbnails for a contact sheet or a quick look at a whole roll) don't need
+the full pipeline, only base removal, inversion, LAB white balance and auto gamma.
+Here the frames are resized to one size and stacked into an (N, H, W, 3) array:
+each colour conversion runs once over the whole stack (frames laid end to end as
+one tall image), the a/b means come from that same LAB conversion rather than a
+second one per frame, the brightness histograms of all frames come from one
+calcHist call, and every frame's lookup table is built in one broadcast operation
+from its parameters. Only the table lookups and channel sums still loop over the
+frames, since OpenCV is fastest at those one frame at a time.
+
+`convert_stack` gives the same pixels as running `convert_proof` on each frame.
+Stacks are 8-bit; 16-bit frames are reduced to 8 bits by `proof_stack`.
+"""
+import cv2
+import numpy as np
+
+from rollshift.image import _base_cutoff, _base_sums, _brightness, apply_lab_white_balance, auto_gamma_correction, find_base
+from rollshift.image import invert, to_uint8
+from rollshift.tone import PARAM_DECIMALS
+
+PROOF_WIDTH = 480  # Width of a proof, as on the contact sheet
+LEVELS = np.arange(256, dtype=np.float64)
+HIST_FRAMES = 65536 // 766  # Frames whose offset brightness bins fit in one uint16 histogram index
+
+
+# Resize the frames to 8-bit proofs of one size and stack them. `images` can be any
+# iterable (e.g. a generator loading scans one at a time); the height follows the
+# first frame's aspect ratio unless given, since the frames of a roll share one.
+# Frames scanned the other way round (portrait in a landscape roll, or the reverse)
+# are turned a quarter to fit instead of being squashed; pass a list as `turned` to
+# get their indices back (see `upright_proofs`). Turning doesn't change any of the
+# per-frame statistics, so their conversion is the same.
+def proof_stack(images, width=PROOF_WIDTH, height=None, turned=None):
+    proofs = []
+    for index, image in enumerate(images):
+        if height is None:
+            height = max(int(round(width * image.shape[0] / image.shape[1])), 1)
+        elif (image.shape[0] - image.shape[1]) * (height - width) < 0:
+            image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+            if turned is not None:
+                turned.append(index)
+        proofs.append(cv2.resize(to_uint8(image), (width, height), interpolation=cv2.INTER_AREA))
+    return np.stack(proofs)
+
+
+# The converted proofs the way they were scanned: turned frames (see `proof_stack`) are
+# turned back and letterboxed into the stack's frame size on a `background` of that level
+def upright_proofs(positives, turned=(), background=20):
+    height, width = positives.shape[1:3]
+    frames = list(positives)
+    for index in turned:
+        frame = cv2.rotate(positives[index], cv2.ROTATE_90_COUNTERCLOCKWISE)
+        fitted = max(int(round(frame.shape[1] * height / frame.shape[0])), 1)
+        if fitted > width:
+            size = (width, max(int(round(frame.shape[0] * width / frame.shape[1])), 1))
+        else:
+            size = (fitted, height)
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        boxed = np.full_like(positives[index], background)
+        top, left = (height - size[1]) // 2, (width - size[0]) // 2
+        boxed[top:top + size[1], left:left + size[0]] = frame
+        frames[index] = boxed
+    return frames
+
+
+def _tall(stack):
+    # The stack as one image of N frames on top of each other, for per-pixel OpenCV calls
+    return stack.reshape(-1, *stack.shape[2:])
+
+
+def _frame_sums(stack):
+    # (N, 4) channel sums; cv2.sumElems per frame beats any single reduction call over the stack
+    return np.array([cv2.sumElems(frame) for frame in stack])
+
+
+def _apply_tables(stack, tables, out=None):
+    # tables: (N, 256) or (N, 256, 3), one per frame; `out` may be `stack` itself
+    result = np.empty_like(stack) if out is None else out
+    tables = tables.reshape(len(stack), 256, 1, -1)
+    for frame, source, table in zip(result, stack, tables):
+        cv2.LUT(source, table, dst=frame)
+    return result
+
+
+def _chunk_hist(brightness):
+    # (n, 766) histograms of n <= HIST_FRAMES frames' brightness, offset into one uint16 index
+    frames = len(brightness)
+    index = brightness + (np.arange(frames, dtype=np.uint16) * 766)[:, None]
+    return cv2.calcHist([index], [0], None, [frames * 766], [0, frames * 766]).reshape(frames, 766)
+
+
+def find_base_stack(stack, percentile=99.0):
+    """
+    Film base of every frame, as `find_base` on each.
+
+    Returns:
+    - (N, 3) array of (B, G, R) bases.
+    """
+    frames, pixels = len(stack), stack.shape[1] * stack.shape[2]
+    brightness = _brightness(_tall(stack)).reshape(frames, pixels)
+    count = max(int((100 - percentile) / 100 * pixels), 1)
+    # Per-frame brightness histograms, one calcHist call per HIST_FRAMES frames: frame n
+    # of a chunk has its bins start at n * 766
+    hist = np.concatenate([
+        _chunk_hist(brightness[start:start + HIST_FRAMES]) for start in range(0, frames, HIST_FRAMES)
+    ])
+    cutoffs = [_base_cutoff(frame_hist, count) for frame_hist in hist]
+    thresholds = np.array([threshold for threshold, _ in cutoffs])
+    n_brighter = np.array([brighter for _, brighter in cutoffs])
+
+    sums = [_base_sums(frame, frame_brightness.reshape(frame.shape[:2]), threshold)
+            for frame, frame_brightness, threshold in zip(stack, brightness, thresholds)]
+    above_sum, tied_mean = (np.array(parts) for parts in zip(*sums))
+    return (above_sum + tied_mean * (count - n_brighter)[:, None]) / count
+
+
+# Invert every frame with its base; `bases` is (N, 3), or one (B, G, R) base for the roll
+def invert_stack(stack, bases):
+    bases = np.broadcast_to(np.asarray(bases, dtype=np.float64), (len(stack), 3))
+    tables = 255 - np.clip((LEVELS[None, :, None] / bases[:, None, :]) * 255, 0, 255).astype(np.uint8)
+    return _apply_tables(stack, tables)
+
+
+# Shift every frame's LAB a/b means to neutral, as `apply_lab_white_balance` on each
+def lab_white_balance_stack(stack):
+    frames = len(stack)
+    lab = cv2.cvtColor(_tall(stack), cv2.COLOR_BGR2LAB).reshape(stack.shape)
+    means = _frame_sums(lab)[:, 1:3] / (stack.shape[1] * stack.shape[2])
+    # One table per frame: L unchanged, a and b shifted by (mean - 128)
+    tables = np.empty((frames, 256, 3), dtype=np.uint8)
+    tables[..., 0] = np.arange(256)
+    tables[..., 1:] = np.clip(LEVELS[None, :, None] - (means[:, None, :] - 128), 0, 255).astype(np.uint8)
+    _apply_tables(lab, tables, out=lab)
+    return cv2.cvtColor(_tall(lab), cv2.COLOR_LAB2BGR).reshape(stack.shape)
+
+
+# Gamma per frame from its mean brightness, as `auto_gamma_correction` on each;
+# pass out=stack to correct the stack in place
+def auto_gamma_stack(stack, out=None):
+    frames = len(stack)
+    gray = cv2.cvtColor(_tall(stack), cv2.COLOR_BGR2GRAY).reshape(frames, -1)
+    mean_intensity = _frame_sums(gray)[:, 0] / gray.shape[1]
+    gammas = np.round(np.clip(1.5 - (mean_intensity / 128), 0.4, 2.5), PARAM_DECIMALS)
+    tables = ((LEVELS[None, :] / 255) ** (1.0 / gammas[:, None]) * 255).astype(np.uint8)
+    return _apply_tables(stack, tables, out)
+
+
+def convert_stack(stack, base=None, film_profile=None):
+    """
+    Converts a stack of proofs (see `proof_stack`) to positives.
+
+    Parameters:
+    - stack: (N, H, W, 3) 8-bit BGR frames.
+    - base: (B, G, R) film base shared by the roll, or (N, 3) bases, instead of
+      detecting each frame's own.
+    - film_profile: Optional `FilmProfile` (rollshift.profiles) to convert every frame
+      with instead of inversion, white balance and gamma, as the pipeline does.
+
+    Returns:
+    - The (N, H, W, 3) positives.
+    """
+    bases = find_base_stack(stack) if base is None else base
+    if film_profile is not None:
+        bases = np.broadcast_to(np.asarray(bases, dtype=np.float64), (len(stack), 3))
+        return np.stack([film_profile.apply(frame, frame_base) for frame, frame_base in zip(stack, bases)])
+    balanced = lab_white_balance_stack(invert_stack(stack, bases))
+    return auto_gamma_stack(balanced, out=balanced)
+
+
+# The same conversion for a single proof, one stage call at a time
+def convert_proof(image, base=None):
+    inverted = invert(image, find_base(image) if base is None else base)
+    return auto_gamma_correction(apply_lab_white_balance(inverted))
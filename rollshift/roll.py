@@ -0,0 +1,92 @@
+"""Film base estimation shared by every frame of a roll.
+
+Estimating the orange mask once per roll instead of once per frame keeps colours
+consistent across the roll (underexposed or sky-heavy frames no longer get their
+own, skewed base) and removes the base detection cost from every frame.
+"""
+import json
+import os
+
+import numpy as np
+
+from rollshift.image import find_base, load_image
+
+ROLL_BASE_FILE = "roll_base.json"
+
+
+# Pick `count` evenly spaced paths so the estimate covers the whole roll
+def sample_frames(paths, count=6):
+    if len(paths) <= count:
+        return list(paths)
+    indices = np.linspace(0, len(paths) - 1, count).round().astype(int)
+    return [paths[i] for i in indices]
+
+
+# Combine per-frame estimates with a per-channel median so outlier frames can't skew the roll
+def estimate_roll_base(frames, percentile=99.0, stride=4):
+    bases = [find_base(frame, percentile, stride) for frame in frames]
+    return np.median(bases, axis=0)
+
+
+# Base from an unexposed area (film rebate, or a scan of the leader when region is None)
+def base_from_region(image, region=None):
+    if region is not None:
+        x, y, width, height = region
+        image = image[y:y + height, x:x + width]
+    return np.median(image.reshape(-1, 3), axis=0)
+
+
+class RollBase:
+    """
+    The film base shared by the frames of one roll.
+
+    Parameters:
+    - base: (B, G, R) base used for every frame.
+    - overrides: Optional {frame name: (B, G, R) or "auto"} for frames that need their
+      own base; "auto" estimates the base from that frame alone with `find_base`.
+    """
+
+    def __init__(self, base, overrides=None):
+        self.base = np.asarray(base, dtype=np.float64)
+        self.overrides = {
+            name: value if isinstance(value, str) else np.asarray(value, dtype=np.float64)
+            for name, value in (overrides or {}).items()
+        }
+
+    # Returns the base for a frame, or None when it should be estimated per frame
+    def for_frame(self, name):
+        override = self.overrides.get(name, self.base)
+        return None if isinstance(override, str) else override
+
+    @classmethod
+    def from_scans(cls, paths, count=6):
+        return cls(estimate_roll_base([load_image(path) for path in sample_frames(paths, count)]))
+
+    @classmethod
+    def from_leader(cls, path, region=None):
+        return cls(base_from_region(load_image(path), region))
+
+    def save(self, path):
+        overrides = {
+            name: value if isinstance(value, str) else value.tolist()
+            for name, value in self.overrides.items()
+        }
+        with open(path, "w") as roll_file:
+            json.dump({"base": self.base.tolist(), "overrides": overrides}, roll_file, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as roll_file:
+            data = json.load(roll_file)
+        return cls(data["base"], data.get("overrides"))
+
+
+# Load the roll's cached base from `directory`, estimating and caching it on first use
+def load_or_estimate(directory, paths, leader=None, count=6):
+    cache_path = os.path.join(directory, ROLL_BASE_FILE)
+    if os.path.exists(cache_path):
+        return RollBase.load(cache_path)
+    roll = RollBase.from_leader(leader) if leader else RollBase.from_scans(paths, count)
+    os.makedirs(directory, exist_ok=True)
+    roll.save(cache_path)
+    return roll
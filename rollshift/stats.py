@@ -0,0 +1,74 @@
+"""Global image statistics for the automatic adjustments, measured on a sample.
+
+White balance, auto gamma and the dynamic curve only need global estimates (channel
+means and maxima, the gray mean and histogram, the LAB a/b means), which are stable
+on a subsampled image. `ImageStats` takes one strided sample of about SAMPLE_PIXELS
+pixels per image, on first use, and derives every statistic from it; pass
+exact=True to measure on the full-resolution image instead. Images at or below
+SAMPLE_PIXELS are always measured exactly.
+"""
+import math
+from functools import cached_property
+
+import cv2
+import numpy as np
+
+SAMPLE_PIXELS = 1_000_000
+
+
+class ImageStats:
+    """
+    Lazily computed global statistics of one 8- or 16-bit BGR image.
+
+    Parameters:
+    - image: The image to measure (also works on memory-mapped arrays).
+    - exact: Measure every pixel instead of a strided sample.
+    - sample_pixels: Approximate size of the sample.
+    """
+
+    def __init__(self, image, exact=False, sample_pixels=SAMPLE_PIXELS):
+        self.image = image
+        self.exact = exact
+        pixels = image.shape[0] * image.shape[1]
+        self.stride = 1 if exact else max(1, math.ceil(math.sqrt(pixels / sample_pixels)))
+
+    # Describes how the statistics are measured, so they can be part of a pipeline stage key
+    def __repr__(self):
+        return f"ImageStats(exact={self.exact}, stride={self.stride})"
+
+    @cached_property
+    def sample(self):
+        if self.stride == 1:
+            return self.image
+        return np.ascontiguousarray(self.image[::self.stride, ::self.stride])
+
+    @cached_property
+    def channel_means(self):
+        return cv2.mean(self.sample)[:3]
+
+    @cached_property
+    def channel_max(self):
+        return self.sample.reshape(-1, 3).max(axis=0)
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.sample, cv2.COLOR_BGR2GRAY)
+
+    @cached_property
+    def gray_mean(self):
+        return cv2.mean(self.gray)[0]
+
+    @cached_property
+    def gray_histogram(self):
+        levels = np.iinfo(self.image.dtype).max + 1
+        return cv2.calcHist([self.gray], [0], None, [levels], [0, levels])[:, 0]
+
+    # a/b means in the image's LAB encoding: centred on 128 for 8-bit images, on 0 in
+    # the float LAB used for 16-bit ones
+    @cached_property
+    def lab_ab_means(self):
+        if self.sample.dtype == np.uint16:
+            lab = cv2.cvtColor(self.sample.astype(np.float32) * (1 / 65535), cv2.COLOR_BGR2LAB)
+        else:
+            lab = cv2.cvtColor(self.sample, cv2.COLOR_BGR2LAB)
+        return cv2.mean(lab)[1:3]
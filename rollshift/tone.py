@@ -0,0 +1,122 @@
+"""Tone curves as per-channel lookup tables.
+
+Every per-channel map of a pixel value (inversion, channel scaling, gamma, the
+adaptive dynamic curve) is compiled into a table with 256 entries for 8-bit images
+and 65536 for 16-bit ones, either 1-D (shared by all channels) or (levels, 3) with
+one column per B, G, R channel. Chains of curves are composed into a single table,
+so applying them costs one `cv2.LUT` call (an indexed gather for 16-bit images)
+and no full-size float buffers.
+
+Curves that depend only on their parameters (gamma, RGB factors) are memoized by
+parameter rounded to PARAM_DECIMALS: the manual sliders move in 0.05 steps and the
+auto gamma is clipped to 0.4..2.5, so only a small set of tables is ever built.
+Memoized tables are read-only.
+"""
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+PARAM_DECIMALS = 3  # Precision curve parameters are memoized at
+
+
+# Largest value a channel of this image (or dtype) can hold: 255 or 65535
+def max_value(image):
+    return np.iinfo(getattr(image, "dtype", image)).max
+
+
+def _quantize(value):
+    return round(float(value), PARAM_DECIMALS)
+
+
+def _read_only(table):
+    table.flags.writeable = False
+    return table
+
+
+def _levels(dtype):
+    return np.arange(max_value(dtype) + 1, dtype=np.float64)[:, None]
+
+
+def scale_lut(scales, dtype=np.uint8):
+    top = max_value(dtype)
+    return np.clip(_levels(dtype) * np.asarray(scales, dtype=np.float64), 0, top).astype(dtype)
+
+
+def invert_lut(base, dtype=np.uint8):
+    top = max_value(dtype)
+    return top - np.clip((_levels(dtype) / np.asarray(base, dtype=np.float64)) * top, 0, top).astype(dtype)
+
+
+@lru_cache(maxsize=128)
+def _gamma_lut(gamma, dtype):
+    top = max_value(dtype)
+    return _read_only(((_levels(dtype)[:, 0] / top) ** (1.0 / gamma) * top).astype(dtype))
+
+
+def gamma_lut(gamma, dtype=np.uint8):
+    return _gamma_lut(_quantize(gamma), np.dtype(dtype))
+
+
+@lru_cache(maxsize=128)
+def _rgb_lut(r_factor, g_factor, b_factor, dtype):
+    return _read_only(scale_lut((b_factor, g_factor, r_factor), dtype))
+
+
+def rgb_lut(r_factor, g_factor, b_factor, dtype=np.uint8):
+    return _rgb_lut(_quantize(r_factor), _quantize(g_factor), _quantize(b_factor), np.dtype(dtype))
+
+
+# Adaptive curve from a brightness histogram's CDF, lifting shadows and compressing highlights
+def dynamic_lut_table(hist, dtype=np.uint8):
+    levels = len(hist)
+    cdf = hist.cumsum()
+    cdf_normalized = cdf * float(hist.max()) / cdf[-1]
+    return np.interp(np.arange(levels), cdf_normalized, np.arange(levels)).astype(dtype)
+
+
+def compose_luts(*luts):
+    # Tables are applied left to right; 1-D tables are shared by all three channels
+    result = np.arange(len(luts[0]), dtype=np.intp)[:, None].repeat(3, axis=1)
+    for lut in luts:
+        lut = lut[:, None].repeat(3, axis=1) if lut.ndim == 1 else lut
+        result = np.take_along_axis(lut, result.astype(np.intp), axis=0)
+    return result
+
+
+@lru_cache(maxsize=128)
+def _tone_curve(gamma, r_factor, g_factor, b_factor, dtype):
+    return _read_only(compose_luts(_gamma_lut(gamma, dtype), _rgb_lut(r_factor, g_factor, b_factor, dtype)))
+
+
+def tone_curve(dtype=np.uint8, gamma=1.0, r_factor=1.0, g_factor=1.0, b_factor=1.0, dynamic=None):
+    """
+    Composes the tone curves into one (levels, 3) table.
+
+    Parameters:
+    - dtype: Image depth the table is for (np.uint8 or np.uint16).
+    - gamma: Gamma applied first (after `dynamic`).
+    - r_factor, g_factor, b_factor: Per-channel factors applied after the gamma.
+    - dynamic: Optional table from `dynamic_lut_table` applied before everything else.
+
+    Returns:
+    - A table for `apply_lut`; the gamma and RGB part is memoized.
+    """
+    table = _tone_curve(
+        _quantize(gamma), _quantize(r_factor), _quantize(g_factor), _quantize(b_factor), np.dtype(dtype)
+    )
+    return table if dynamic is None else compose_luts(dynamic, table)
+
+
+def apply_lut(image, lut):
+    if image.dtype == np.uint8:
+        if lut.ndim == 1:
+            return cv2.LUT(image, lut)
+        return cv2.LUT(image, np.ascontiguousarray(lut).reshape(256, 1, 3))
+    # cv2.LUT only takes 8-bit input; 16-bit images use an indexed gather per channel
+    if lut.ndim == 1:
+        return lut[image]
+    result = np.empty_like(image)
+    for channel in range(3):
+        result[..., channel] = lut[:, channel][image[..., channel]]
+    return result
@@ -0,0 +1,58 @@
+"""Page setup shared by the Streamlit pages: page config, sidebar logo and styles.
+
+Every page injects one <style> block, built once per process: SIDEBAR_CSS on
+every page, plus whatever the page adds (the converter's full-width buttons and
+its title font). Fonts are embedded from rollshift.assets, read and encoded once
+per process, and only on the pages that use them.
+"""
+from functools import lru_cache
+
+import streamlit as st
+
+from rollshift.assets import asset_base64, asset_path, read_asset
+
+SIDEBAR_CSS = """
+    section[data-testid="stSidebar"] {
+        width: 200px !important;
+    }
+"""
+BUTTON_CSS = """
+    .stDownloadButton>button, .stButton>button {
+        width: 100% !important;
+        font-size: 18px;
+        font-weight: bold;
+        padding: 10px;
+    }
+"""
+
+
+# Styles setting h1 titles in an OTF font of the repository, e.g. title_font("Bristol", "media/fonts/Bristol.otf")
+@lru_cache(maxsize=None)
+def title_font(family, path):
+    return f"""
+    @font-face {{
+        font-family: '{family}';
+        src: url(data:font/otf;base64,{asset_base64(path)}) format('opentype');
+    }}
+    h1 {{
+        font-family: '{family}', sans-serif !important;
+    }}
+"""
+
+
+@lru_cache(maxsize=None)
+def page_style(css):
+    return f"<style>{SIDEBAR_CSS}{css}</style>"
+
+
+# Function to set up a page: must run before anything else is drawn on it. `css` is
+# added to the page's styles.
+def setup_page(css=""):
+    st.set_page_config(
+        page_title="RollShift AI",
+        page_icon=asset_path("media/brand/RS_Fav.png"),
+        layout="centered",
+    )
+    # Display the logo in the sidebar with a small size
+    st.logo(read_asset("media/brand/RS_logo.png"), size="large")
+    st.markdown(page_style(css), unsafe_allow_html=True)
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from rollshift.cache import CachedResult, ResultCache
+from rollshift.large import new_memmap
+
+PREVIEW = [("Denoised Image", np.zeros((8, 8, 3), dtype=np.uint8))]
+
+
+def large_result(directory, value):
+    image = new_memmap(os.path.join(directory, "denoised.npy"), np.uint8, (32, 32, 3))
+    image[:] = value
+    return CachedResult(image, PREVIEW, {})
+
+
+# Without spilling, an evicted large-scan result takes its file and work directory with it
+def test_evicted_large_result_is_deleted_without_spill(tmp_path, monkeypatch):
+    monkeypatch.setenv("ROLLSHIFT_SPILL_MB", "0")
+    cache = ResultCache(max_bytes=PREVIEW[0][1].nbytes, spill_dir=str(tmp_path))
+    first = large_result(str(tmp_path / "first"), 1)
+    cache.put("first", first)
+    cache.put("second", large_result(str(tmp_path / "second"), 2))
+    assert cache.get("first") is None
+    assert not (tmp_path / "first").exists() and (tmp_path / "second" / "denoised.npy").exists()
+    assert (first.image == 1).all()  # Still readable through the existing mapping
+
+
+# A new run writes a new file, so an earlier result mapped from the same path keeps its pixels
+def test_new_memmap_leaves_existing_mappings(tmp_path):
+    earlier = large_result(str(tmp_path), 1).image
+    later = large_result(str(tmp_path), 2).image
+    assert (earlier == 1).all() and (later == 2).all()
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+import pytest
+
+from rollshift import image
+from rollshift.image import DENOISE_MODES, denoise_tiled
+
+NOISE = np.random.default_rng(0).integers(0, 256, (241, 323, 3), dtype=np.uint8)  # Odd edges on purpose
+
+
+# Tiles are filtered with their overlap and cropped back, so the result is the full-frame one
+@pytest.mark.parametrize("mode", sorted(DENOISE_MODES))
+@pytest.mark.parametrize("bits", [8, 16])
+def test_tiles_match_full_frame(mode, bits):
+    image = NOISE if bits == 8 else NOISE.astype(np.uint16) * 257
+    tile_filter = DENOISE_MODES[mode][0]
+    expected = tile_filter(image, 3)
+    np.testing.assert_array_equal(denoise_tiled(image, 3, tile_size=101, workers=2, mode=mode), expected)
+
+
+# The tile pool takes the process's OpenCV thread count, which each job queue and batch
+# worker sets to its share of the cores
+def test_tile_pool_follows_opencv_threads(monkeypatch):
+    sizes = []
+
+    class Pool(image.ThreadPoolExecutor):
+        def __init__(self, max_workers=None):
+            sizes.append(max_workers)
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(image, "ThreadPoolExecutor", Pool)
+    threads = cv2.getNumThreads()
+    try:
+        cv2.setNumThreads(3)
+        denoise_tiled(NOISE, 3, mode="bilateral")
+    finally:
+        cv2.setNumThreads(threads)
+    assert sizes == [3]
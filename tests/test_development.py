@@ -0,0 +1,57 @@
+"""Developer times against the published charts in rollshift/processes.json."""
+import pytest
+
+from rollshift.development import load_catalogue
+
+CATALOGUE = load_catalogue()
+
+
+@pytest.mark.parametrize("key", list(CATALOGUE))
+def test_chart_points(key):
+    process = CATALOGUE[key]
+    for temperature, seconds in process.chart:
+        assert process.developer_time(temperature) == round(seconds)
+
+
+def test_tri_x_between_chart_points():
+    process = CATALOGUE["kodak-tx400-d76"]
+    # Halfway between 20 °C (6:45) and 21 °C (6:00), interpolated in log time
+    assert process.developer_time(20.5) == round((405 * 360) ** 0.5)
+    times = [process.developer_time(18 + step / 10) for step in range(61)]
+    assert times == sorted(times, reverse=True)
+
+
+def test_cs41_lower_temperatures():
+    process = CATALOGUE["cinestill-cs41"]
+    assert process.chart_range == (26.7, 39.0) and process.nominal_temperature == 39.0
+    assert process.developer_time(26.7) == 780  # 13:00 at 80 °F
+    # Interpolated in log time: 35 °C is 0.7 of the way from 26.7 °C to 39 °C
+    fraction = (35.0 - 26.7) / (39.0 - 26.7)
+    assert process.developer_time(35.0) == round(780 ** (1 - fraction) * 210 ** fraction)
+    times = [process.developer_time(26.7 + step / 10) for step in range(124)]
+    assert times == sorted(times, reverse=True)
+    # Push/pull factors apply at every temperature (to the unrounded time)
+    assert process.developer_time(30.0, push_pull=1) == pytest.approx(process.developer_time(30.0) * 1.3, abs=1)
+
+
+def test_outside_chart_keeps_nearest_end():
+    process = CATALOGUE["kodak-tx400-d76"]
+    assert process.developer_time(15.0) == 480
+    assert process.developer_time(30.0) == 300
+
+
+# The Development Assistant's former hard-coded Cs41 schedule
+@pytest.mark.parametrize("push_pull, seconds", [(-2, 136), (-1, 168), (0, 210), (1, 273), (2, 315)])
+def test_cs41_matches_previous_times(push_pull, seconds):
+    schedule = CATALOGUE["cinestill-cs41"].schedule(39.0, push_pull)
+    assert schedule == [
+        ("Pre-Soak", 60, 60, 10),
+        ("Color Developer", seconds, 30, 10),
+        ("Blix (Bleach + Fix)", 480, 30, 10),
+        ("Final Rinse", 180, 0, 0),
+    ]
+
+
+def test_unknown_push_pull():
+    with pytest.raises(ValueError):
+        CATALOGUE["kodak-c41"].developer_time(37.8, push_pull=1)
@@ -0,0 +1,45 @@
+"""`find_base` against the original argsort implementation, on the sample negatives."""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from rollshift.image import find_base, load_image
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media", "samples", "*negative*")))
+# 8-bit levels per channel: argsort keeps an arbitrary subset of the pixels tied at the
+# cut-off where find_base averages all of them (measured: up to 0.003, 0.021 with stride 2)
+TOLERANCE = 0.025
+
+
+# The original implementation: mean of the top 1% brightest pixels by a full sort
+def argsort_find_base(neg):
+    flat_img = neg.reshape(-1, 3)
+    brightness = np.sum(flat_img, axis=1, dtype=np.int64)
+    idx = np.argsort(brightness)[-int(0.01 * len(brightness)):]
+    return np.mean(flat_img[idx], axis=0)
+
+
+@pytest.fixture(params=SAMPLES, ids=os.path.basename)
+def sample(request):
+    return load_image(request.param)
+
+
+def test_samples_found():
+    assert SAMPLES
+
+
+def test_matches_argsort(sample):
+    np.testing.assert_allclose(find_base(sample), argsort_find_base(sample), rtol=0, atol=TOLERANCE)
+
+
+def test_matches_argsort_16_bit(sample):
+    sample16 = sample.astype(np.uint16) * 257
+    np.testing.assert_allclose(find_base(sample16), argsort_find_base(sample16), rtol=0, atol=TOLERANCE * 257)
+
+
+@pytest.mark.parametrize("stride", [2, 3])
+def test_matches_argsort_strided(sample, stride):
+    expected = argsort_find_base(np.ascontiguousarray(sample[::stride, ::stride]))
+    np.testing.assert_allclose(find_base(sample, stride=stride), expected, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+import pytest
+
+from rollshift.image import decode_image, encode_image
+from rollshift.large import banded_shape, decode_to_memmap
+
+RNG = np.random.default_rng(0)
+
+
+# TIFFs are decoded band by band (a few rows at a time here) to the pixels of a full decode
+@pytest.mark.parametrize("compression", [1, 5, 8, 32773])  # None, LZW, Deflate, PackBits
+@pytest.mark.parametrize("shape", [(301, 203, 3), (301, 203), (120, 77, 4)])
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_tiff_bands_match_full_decode(tmp_path, compression, shape, dtype):
+    image = RNG.integers(0, np.iinfo(dtype).max + 1, shape, dtype=dtype)
+    data = cv2.imencode(".tiff", image, [cv2.IMWRITE_TIFF_COMPRESSION, compression])[1].tobytes()
+    assert banded_shape(data) == shape[:2]
+    mapped = decode_to_memmap(data, str(tmp_path / "raw.npy"), band_bytes=5000)
+    expected = decode_image(data)
+    assert isinstance(mapped, np.memmap) and mapped.dtype == expected.dtype
+    np.testing.assert_array_equal(mapped, expected)
+
+
+# Formats OpenCV can only decode whole are decoded first and then written out
+def test_other_formats_decode_whole(tmp_path):
+    data = encode_image(RNG.integers(0, 256, (64, 48, 3), dtype=np.uint8), "PNG")
+    assert banded_shape(data) is None
+    np.testing.assert_array_equal(decode_to_memmap(data, str(tmp_path / "raw.npy")), decode_image(data))
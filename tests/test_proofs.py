@@ -0,0 +1,36 @@
+import numpy as np
+
+from rollshift.image import find_base
+from rollshift.proofs import HIST_FRAMES, convert_proof, convert_stack, find_base_stack, proof_stack, upright_proofs
+
+RNG = np.random.default_rng(0)
+
+
+def synthetic_roll(frames, shape=(24, 32)):
+    roll = RNG.integers(20, 230, (frames, *shape, 3), dtype=np.uint8)
+    roll[:, :3] = RNG.integers(200, 256, (frames, 3, shape[1], 3))  # A bright rebate to find the base on
+    return roll
+
+
+# More frames than one uint16 histogram index holds (see HIST_FRAMES)
+def test_stack_matches_frame_by_frame():
+    roll = synthetic_roll(HIST_FRAMES + 15)
+    np.testing.assert_array_equal(find_base_stack(roll), [find_base(frame) for frame in roll])
+    positives = convert_stack(roll.copy())
+    for frame, positive in zip(roll, positives):
+        np.testing.assert_array_equal(positive, convert_proof(frame))
+
+
+# A portrait frame in a landscape roll is turned into the stack, converted like the
+# rest, and comes back upright and letterboxed rather than squashed
+def test_turned_frames_are_letterboxed():
+    landscape, portrait = synthetic_roll(1, (40, 60))[0], synthetic_roll(1, (60, 40))[0]
+    turned = []
+    stack = proof_stack([landscape, portrait], width=60, turned=turned)
+    assert stack.shape == (2, 40, 60, 3) and turned == [1]
+    np.testing.assert_array_equal(stack[1], np.rot90(portrait, -1))
+    frames = upright_proofs(stack, turned, background=20)
+    np.testing.assert_array_equal(frames[0], stack[0])
+    assert frames[1].shape == (40, 60, 3)
+    left = (60 - 27) // 2  # 40 x 60 scaled to 40 rows is 27 columns wide
+    assert (frames[1][:, :left] == 20).all() and (frames[1][:, left + 27:] == 20).all()
@@ -0,0 +1,17 @@
+import numpy as np
+
+from rollshift.roll import RollBase
+
+
+def test_overrides_accept_arrays_and_auto(tmp_path):
+    roll = RollBase((30, 80, 200), {"01.tif": np.array([25, 70, 190]), "02.tif": "auto", "03.tif": [20, 60, 180]})
+    assert roll.for_frame("01.tif").tolist() == [25, 70, 190]
+    assert roll.for_frame("02.tif") is None
+    assert roll.for_frame("03.tif").tolist() == [20, 60, 180]
+    assert roll.for_frame("04.tif").tolist() == [30, 80, 200]
+
+    path = tmp_path / "roll_base.json"
+    roll.save(path)
+    loaded = RollBase.load(path)
+    assert loaded.for_frame("01.tif").tolist() == [25, 70, 190]
+    assert loaded.for_frame("02.tif") is None